@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+import argparse
+import shutil
+import tempfile
+import time
+
+import settings
+
+from dcbot import DCbot
+from utils.simulator import SimHub
+from utils.logs import Logger
+
+
+class Bench:
+
+    def __init__(self):
+        self.logger = Logger(True, False)
+        self.parse_args()
+        self.run()
+
+    def parse_args(self):
+        """Parses command-line arguments.
+        """
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--users", type=int, default=100,
+                            help="Number of simulated users")
+        parser.add_argument("--files", type=int, default=1000,
+                            help="Number of files in each file list")
+        parser.add_argument("--latency", type=float, default=0.0,
+                            help="Delay of every answer in seconds")
+        parser.add_argument("--bandwidth", type=int, default=0,
+                            help="Upload rate of each user in KB/s, "
+                                 "0 is unlimited")
+        parser.add_argument("--concurrency", type=int,
+                            default=settings.CONCURRENCY,
+                            help="Number of users fetched in parallel")
+        parser.add_argument("--port", type=int, default=41100,
+                            help="Port of the simulated hub")
+
+        args = parser.parse_args()
+        self.users = args.users
+        self.files = args.files
+        self.latency = args.latency
+        self.bandwidth = args.bandwidth * 1024
+        self.concurrency = args.concurrency
+        self.port = args.port
+
+    def run(self):
+        """Crawls the simulated hub with dcBot and reports the
+        throughput.
+        """
+        self.logger.display("Creating {} users with {} files each...".
+                            format(self.users, self.files), "info")
+        hub = SimHub(self.port, self.users, self.files, self.latency,
+                     self.bandwidth)
+        # keep the file lists, history, checkpoints and run summaries of
+        # the benchmark out of tmp/ and data/
+        folders = dict((name, getattr(settings, name)) for name in
+                       ('TMP_FOLDER', 'STORE_FOLDER', 'HISTORY_FOLDER',
+                        'CHECKPOINT_FOLDER', 'RUNS_FOLDER'))
+        bench_folder = tempfile.mkdtemp() + "/"
+        for name in folders:
+            setattr(settings, name,
+                    bench_folder + name.split('_')[0].lower() + "/")
+        try:
+            start = time.time()
+            bot = DCbot(['-a', '127.0.0.1', '-p', str(self.port),
+                         '--ip', '127.0.0.1', '--force',
+                         '-c', str(self.concurrency)])
+            elapsed = time.time() - start
+        finally:
+            hub.close()
+            shutil.rmtree(bench_folder)
+            for name, folder in folders.items():
+                setattr(settings, name, folder)
+        self.report(bot, elapsed)
+
+    def report(self, bot, elapsed):
+        """Displays users/s, MB/s and the p50/p99 fetch time.\n
+        Args:
+            bot (DCbot): The finished crawler.
+            elapsed (float): Duration of the crawl in seconds.
+        """
+        times = sorted(bot.fetch_times)
+        megabytes = bot.bytes_received / (1024.0 * 1024.0)
+        self.logger.display("Fetched {} of {} users in {:.2f}s.".format(
+                            bot.user_count, bot.users_found, elapsed), "ok")
+        self.logger.display("{:.2f} users/s, {:.3f} MB/s.".format(
+                            bot.user_count / elapsed, megabytes / elapsed),
+                            "ok")
+        if times:
+            self.logger.display("Fetch time p50: {:.3f}s, p99: {:.3f}s.".
+                                format(self.percentile(times, 50),
+                                       self.percentile(times, 99)), "ok")
+
+    def percentile(self, values, p):
+        """Get the p-th percentile of sorted values (nearest rank).
+        """
+        rank = max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1)
+        return values[min(rank, len(values) - 1)]
+
+
+if __name__ == '__main__':
+    bench = Bench()
@@ -1,40 +1,77 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
 #   2017 - Mahdi Enan and Florian Platzer
 
 import os
-import bz2
 import sys
-import math
+import json
 import time
 import zlib
-import uuid
-import errno
-import fcntl
 import socket
-import hashlib
+import binascii
 import argparse
 import settings
 import threading
 
 from datetime import datetime
 from utils.connection import Connector
-from utils.protocol import DC
+from utils.crawler import Crawler
+from utils.history import CrawlHistory
+from utils.checkpoint import Checkpoint
+from utils.scheduler import share_priority
+from utils.protocol import DC, decode, encode, printable
+from utils.stream import ListDecompressor
+from utils.store import ListStore
+from utils.pipeline import Pipeline
+from utils.rate import RateMeter
+from utils.metrics import Metrics
 from utils.logs import Logger
 
 
+def write_servinfo(host, port, perc):
+    """Write down hub (server) information.\n
+    Args:
+        host (string): Hub (Server) domain name or ip address.
+        port (int): Hub (Server) port number.
+        perc (string): Percentage of users whose lists are known.
+    """
+    servinfo = open(settings.TMP_FOLDER + "servinfo", "a")
+    servinfo.write(str(host) + "|" +
+                   str(port) + "|" +
+                   str(perc) + "|" +
+                   "false|false\n")
+    servinfo.close()
+
+
 class DCbot:
 
     # default values
     nick = "defaultNickname"
     verbose = False
-    nic = "tun0"  # Network device; eth0, enp0s3, wlp3s0, ...
+    nic = settings.NIC  # Network device; eth0, enp0s3, wlp3s0, ...
+    concurrency = settings.CONCURRENCY  # users fetched in parallel
+    cc_port = settings.CC_PORT  # port of the c2c listener
+    ip = None  # announced ip, discovered if not given
     user_count = 0  # number of user lists fetched
-
-    def __init__(self):
+    users_found = 0  # number of users in the nick list
+    bytes_received = 0  # compressed bytes of all fetched lists
+    fetch_times = []  # seconds it took to fetch each list
+    force = False  # fetch lists of unchanged users as well
+    daemon = False  # stay on the hub and follow joins and quits
+    rate = None  # $ConnectToMe per second, default from HUB_RATES/CTM_RATE
+    skipped = 0  # number of unchanged users
+    resume = False  # continue an interrupted crawl from its checkpoint
+    resumed = 0  # number of users fetched before the interruption
+    bind = None  # source address of all connections
+    shard = (0, 1)  # fetch the users of shard K of N
+    pipeline = None  # fills the database while crawling (--pipeline)
+    metrics_file = settings.METRICS_FILE  # Prometheus text file
+    metrics_port = settings.METRICS_PORT  # Prometheus HTTP endpoint
+
+    def __init__(self, argv=None):
         """Implement main functionality
-            * parse arguments.
+            * parse arguments (argv, default sys.argv).
             * create logging instance.
             * create connction instance.
             * create model (dc) instance.
@@ -48,56 +85,101 @@ class DCbot:
         if not os.path.exists('debug/'):
             os.makedirs('debug/')
 
-        self.parse_args()
+        self.parse_args(argv)
+        self.start_time = time.time()
+        self.stats_lock = threading.Lock()
+        self.users_info = {}  # nick -> parsed $MyINFO
+        self.bots = set()  # operators and bots from $OpList
+        self.store = ListStore()
 
         self.logger = Logger(self.verbose, True)
+        self.pipeline = Pipeline(self.logger, self.store) \
+            if self.pipeline else None
+        self.metrics = Metrics({'hub': "{}:{}".format(self.host, self.port)})
+        self.metrics_written = 0
+        if self.pipeline is not None:
+            self.metrics.gauge('pipeline_parse_queue',
+                               self.pipeline.parse_queue.qsize)
+            self.metrics.gauge('pipeline_write_queue',
+                               self.pipeline.write_queue.qsize)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
         self.connection = Connector(self.logger)
+        if self.bind is not None:
+            self.bind = self.connection.source_address(self.bind)
         self.dc = DC(self.logger,
                      self.connection,
                      settings.BUFFER_SIZE,
-                     dict([("nick", self.nick)]),
+                     dict([("nick", self.nick), ("rate", self.rate)]),
                      self)
 
-        self.sock = self.connection.open_sock(self.host, self.port, self.nic)
-        self.dc.handshake_c2s(self.sock)
-
-        userlist, rawlist = self.fetch_users(self.sock)
-
-        if userlist is not None or userlist is not []:
-            self.traverse_users(self.sock, userlist)
-        else:
-            self.logger.display("Could not fetch user list exiting", "err")
-        recveived = self.sock.recv(settings.BUFFER_SIZE)
-        if recveived != '':
-            self.logger.display(recveived)
-
-        self.sock.close()
-
-    def reconnect(self, host, port):
-        self.host = host
-        self.port = int(port)
+        self.visited = set([(self.host, self.port)])  # against loops
 
-        self.sock.close()
-        self.sock = self.connection.open_sock(self.host, self.port, self.nic)
+        try:
+            self.crawl()
+            # a redirect ends the crawl of the hub, then the next begins
+            while self.dc.redirect is not None:
+                self.reconnect(*self.dc.redirect)
+        finally:
+            # a refusing hub exits, the c2c port must be free for the next
+            if self.connection.sock is not None:
+                self.connection.sock.close()
+            self.connection.close_listener()
+            # everything fetched so far ends up in the database
+            if self.pipeline is not None:
+                self.pipeline.close()
+            self.export_metrics(True)
+            self.metrics.close()
+
+    def crawl(self):
+        """Connect to the hub, perform the handshake, fetch the user list
+        and traverse its users. Returns early when the hub redirects.
+        """
+        self.sock = self.connection.open_sock(self.host, self.port,
+                                             self.nic, self.bind)
         self.dc.handshake_c2s(self.sock)
+        if self.dc.redirect is not None:
+            return
 
         userlist, rawlist = self.fetch_users(self.sock)
+        if self.dc.redirect is not None:
+            return
 
         if userlist is not None or userlist is not []:
             self.traverse_users(self.sock, userlist)
         else:
             self.logger.display("Could not fetch user list exiting", "err")
-        recveived = self.sock.recv(settings.BUFFER_SIZE)
-        if recveived != '':
-            self.logger.display(recveived)
+        if self.dc.redirect is not None:
+            return
+        for recveived in self.dc.hub.poll():
+            if not recveived.startswith(b'$'):
+                self.logger.display(decode(recveived))
 
+    def reconnect(self, host, port):
+        """Leave the current hub and crawl the hub it redirected to.
+        Called once the crawl of the current hub has ended. A hub that
+        was crawled before is not visited again.\n
+        Args:
+            host (string): Address of the new hub.
+            port (int): Port of the new hub.
+        """
+        self.dc.redirect = None
+        if (host, port) in self.visited:
+            self.logger.display("Redirect loop to " + host + ", "
+                                "exiting.", "warn")
+            return
+        self.visited.add((host, port))
         self.sock.close()
+        self.host = host
+        self.port = port
+        # the counters describe the new hub
+        self.user_count = self.skipped = self.resumed = 0
+        self.crawl()
 
-
-
-
-    def parse_args(self):
+    def parse_args(self, argv=None):
         """Parse arguments passed to script
+        Args:
+            argv (list): Arguments, default sys.argv.
         """
         parser = argparse.ArgumentParser()
         parser.add_argument("-a", "--address", help="DC hub (server) address.",
@@ -113,147 +195,274 @@ class DCbot:
                             action='store_true', required=False)
         parser.add_argument("-i", "--interface", help="network interface",
                             required=False)
+        parser.add_argument("-c", "--concurrency", type=int,
+                            help="number of users fetched in parallel",
+                            required=False)
+        parser.add_argument("--cc_port", type=int,
+                            help="port users connect to",
+                            required=False)
+        parser.add_argument("--ip", help="ip address users connect to",
+                            required=False)
+        parser.add_argument("-f", "--force",
+                            help="fetch lists of unchanged users as well",
+                            action='store_true', required=False)
+        parser.add_argument("-r", "--rate", type=float,
+                            help="initial $ConnectToMe requests per second",
+                            required=False)
+        parser.add_argument("-b", "--bind",
+                            help="source address or interface of all "
+                                 "connections, default the interface "
+                                 "given with -i",
+                            required=False)
+        parser.add_argument("--shard",
+                            help="fetch only users of shard K/N, for N "
+                                 "crawlers on the same hub (main.py "
+                                 "merges their hub information)",
+                            required=False)
+        parser.add_argument("--pipeline",
+                            help="parse lists and insert them into the "
+                                 "database while crawling, instead of "
+                                 "writing umap and servinfo for manage.py",
+                            action='store_true', required=False)
+        parser.add_argument("--metrics",
+                            help="write metrics in Prometheus text format "
+                                 "to this file",
+                            required=False)
+        parser.add_argument("--metrics_port", type=int,
+                            help="serve metrics in Prometheus text format "
+                                 "on this local port",
+                            required=False)
+        parser.add_argument("--resume",
+                            help="continue an interrupted crawl of the "
+                                 "hub, users it fetched are skipped",
+                            action='store_true', required=False)
+        parser.add_argument("--daemon",
+                            help="stay on the hub and fetch users that "
+                                 "join or change their share",
+                            action='store_true', required=False)
 
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
         self.host = str(args.address)
         self.port = int(args.port)
         self.nick = args.nick if args.nick is not None else self.nick
         self.nic = args.interface if args.interface is not None else self.nic
+        self.bind = args.bind if args.bind is not None else args.interface
+        if args.shard is not None:
+            try:
+                k, n = [int(value) for value in args.shard.split("/")]
+            except ValueError:
+                parser.error("--shard expects K/N, e.g. 0/4")
+            if not 0 <= k < n:
+                parser.error("--shard K/N needs 0 <= K < N")
+            self.shard = (k, n)
+            if n > 1:
+                # the hub does not accept the same nick twice
+                self.nick = "{}_{}".format(self.nick, k)
         self.verbose = args.verbose
+        if args.concurrency is not None:
+            self.concurrency = args.concurrency
+        if args.cc_port is not None:
+            self.cc_port = args.cc_port
+        if args.ip is not None:
+            self.ip = args.ip
+        self.force = args.force
+        self.daemon = args.daemon
+        self.pipeline = args.pipeline
+        self.resume = args.resume
+        if args.metrics is not None:
+            self.metrics_file = args.metrics
+        if args.metrics_port is not None:
+            self.metrics_port = args.metrics_port
+        self.rate = args.rate if args.rate is not None else \
+            settings.HUB_RATES.get("{}:{}".format(self.host, self.port),
+                                   settings.CTM_RATE)
 
     def traverse_users(self, sock, userlist):
-        """+ Iterate over found users and for each:
+        """+ Iterate over found users (several at once) and for each:
             * establish connection,\n
             * perform handshake,\n
             * retrieve filelist.\n
+        Users whose share size did not change since their list was
+        fetched are skipped, unless force is set. With resume, users
+        fetched by the interrupted crawl are skipped as well. The
+        checkpoint and the history are saved when the crawl ends or is
+        interrupted. A redirect of the hub aborts the crawl.\n
+        The hub is read while the users are fetched, in daemon mode
+        until it disconnects.\n
         + Calculate percentage of users that send their info,
         + Write down server information.
            Args:
                sock (socket): Socket for server connection.
                userlist (list): List of available users.
         """
-        self.logger.display("Adjusting buffer size to: 16", "warn")
-        settings.BUFFER_SIZE = 16
-        cc_port = settings.CC_PORT
-        ip = self.connection.get_public_ip()
+        ip = self.ip or self.bind or self.connection.get_public_ip(self.nic)
+        self.connection.listen(self.cc_port, self.bind or '')
+        userlist = [user for user in userlist if self.in_shard(user)]
+        self.users_found = len(userlist)
         self.logger.display("Found [" + str(len(userlist)) + "] users.")
-        for user in userlist:
-            try:
-                self.dc.connect_to_me(sock, user, ip, cc_port)  # Co
-                clink = self.connection.direct_connect(user, cc_port)
-                self.dc.handshake_c2c(user, clink)
-                self.get_filelist(user, clink, True)
-                if self.user_list_fetched:
-                    self.user_count += 1
-                cc_port += 1
-            except socket.timeout:
-                self.logger.display("socket timeout: "
-                                    "Could not establish "
-                                    "connection with user.", "err")
-                cc_port += 1
-            except Exception as e:
-                self.logger.display(str(e), "err")
-                cc_port += 1
+        self.history = CrawlHistory(self.host, self.port, self.shard)
+        self.checkpoint = Checkpoint(self.host, self.port, self.shard)
+        done = self.checkpoint.open(self.resume)
+        if done:
+            self.resumed = len([user for user in userlist if user in done])
+            self.logger.display("Resuming: [" + str(self.resumed) + "] "
+                                "users were fetched before.")
+            remaining = [user for user in userlist if user not in done]
+        else:
+            remaining = userlist
+        if not self.force:
+            changed = [user for user in remaining
+                       if not self.history.unchanged(user, self.share(user))]
+            self.skipped = len(remaining) - len(changed)
+            self.logger.display("Skipping [" + str(self.skipped) + "] "
+                                "unchanged users.")
+        else:
+            changed = remaining
+        self.metrics.inc('users_skipped_total', self.skipped)
+        priority = self.priority if settings.FETCH_ORDER == 'priority' \
+            else None
+        crawler = Crawler(self, sock, ip, self.cc_port, self.concurrency,
+                          priority)
+        scheduler = crawler.scheduler
+        self.metrics.gauge('queue_ready', lambda: len(scheduler.ready))
+        self.metrics.gauge('queue_delayed', lambda: len(scheduler.delayed))
+        self.metrics.gauge('fetches_active', lambda: scheduler.active)
+        for user in changed:
+            crawler.add(user)
+        if self.daemon:
+            crawler.start()
+        else:
+            crawler.close()
+            crawler.start(min(self.concurrency, len(changed)))
+        interrupted = True
+        try:
+            # hub warnings are handled while the users are fetched
+            self.watch_hub(crawler, userlist)
+            interrupted = False
+        finally:
+            # on SIGINT, exit or redirect only the running fetches are
+            # finished, the checkpoint is kept to resume the hub later
+            interrupted = interrupted or self.dc.redirect is not None
+            if interrupted:
+                crawler.abort()
+            self.user_count += crawler.stop()
+            self.history.save()
+            self.checkpoint.close(not interrupted)
+        self.fetch_times = crawler.fetch_times
+        if self.dc.redirect is not None:
+            return
         perc = 0
         if userlist is not None and len(userlist) > 0:
-            perc = str((100.0 * float(self.user_count)) /
+            # unchanged and resumed lists are already known
+            perc = str((100.0 * float(self.user_count + self.skipped +
+                                      self.resumed)) /
                        float(len(userlist)))[:5]
             self.logger.display("Percentage userlists fetched: " +
                                 perc + "%", "ok")
+        self.write_summary(perc)
 
-        # write down hub (server) information
-        servinfo = open(settings.TMP_FOLDER + "servinfo", "a")
-        servinfo.write(str(self.host) + "|" +
-                       str(self.port) + "|" +
-                       str(perc) + "|" +
-                       "false|false\n")
-        servinfo.close()
+        # shards only know a part of the hub, main.py merges them
+        if self.shard[1] == 1 and self.pipeline is not None:
+            self.pipeline.hub(self.host, self.port, perc)
+        elif self.shard[1] == 1:
+            write_servinfo(self.host, self.port, perc)
 
     def get_filelist(self, user, clink, trail):
         """Retrieve filelist (files.xml.bz2) from user.
-           If successfull it is extracted and downloaded into tmp
+           It is extracted into the list store while it is downloaded
+           and kept once, named by the md5 hash of its content.
         Args:
             user (string): The current username.
             clink (socket): Socket for direct connection with user.
+        Returns:
+            True if the file list was fetched, False else.
         """
 
         start_time = datetime.now()  # record time it takes to load list
-        self.user_list_fetched = False
-        getlist = "$ADCGET file files.xml.bz2 0 -1 ZL1|"
-        clink.send(getlist)
-        self.logger.display(getlist, "sent")
-        clink.recv(settings.BUFFER_SIZE * 1024)
-        # self.logger.display(adcsnd, "sent")
-        content = b""
-        packet = None
-        fcntl.fcntl(clink, fcntl.F_SETFL, os.O_NONBLOCK)
-        timeout_set = False  # for the heuristic
-        clink.settimeout(1)
-        t = threading.Thread(target=self.empty_thread_skeleton)
-        while True:
-            try:
-                if timeout_set:
-                    self.logger.display("Continuing...")
-                    timeout_set = False
-                start = time.time()
-                packet = clink.recv(settings.BUFFER_SIZE)
-                if not t.isAlive():
-                    t = threading.Thread(target=self.h_rate,
-                                         args=(start, len(packet)))
-                    t.start()
-                content += packet
-            except socket.error as e:
-                err = e.args[0]
-                if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-                    self.logger.display("No data is being received...",
-                                        "debug")
-                elif err == "timed out":
+        reader = self.connection.sockets[user][2]
+        requested = time.time()
+        data = self.dc.adc_get(reader)[1]
+        self.metrics.observe('first_byte_seconds', time.time() - requested)
+
+        # the pipeline parses small lists from memory
+        filelist = self.store.writer(settings.PIPELINE_INLINE_SIZE
+                                     if self.pipeline is not None else 0)
+        # the bz2 stream is stored as received, not compressed again
+        decompressor = ListDecompressor(filelist, settings.MAX_FILELIST_SIZE,
+                                        filelist.write_stream)
+        receiver = reader.receiver
+        meter = RateMeter()
+        try:
+            decompressor.feed(data)
+            while not decompressor.done():
+                # the deadline follows the rate of this connection
+                clink.settimeout(meter.timeout(receiver.size))
+                try:
+                    packet = receiver.recv()
+                except socket.timeout:
                     self.logger.display("Download stopped.", "debug")
                     break
-                else:
-                    self.logger.display(err, "err")
+                except socket.error as e:
+                    self.logger.display(e, "err")
                     break
-                if not timeout_set:
-                    self.logger.display("Setting timeout: " +
-                                        str(settings.CLIENT_TIMEOUT) +
-                                        "s...", "debug")
-                    clink.settimeout(settings.CLIENT_TIMEOUT)
-                    timeout_set = True
-
-        self.logger.display("Extracting...", "debug")
-        # use with caution, potential for memory bombs!
-        try:
-            content = bz2.decompress(zlib.decompress(content))
-        except Exception:
-            try:
-                content = bz2.decompress(content)
-            except Exception as e:
-                if "invalid data stream" in e:
-                    if trail:
-                        self.logger.display("Invalid data stream", "err")
-                        self.logger.display("Second attempt!", "warn")
-                        self.get_filelist(user, clink, False)
-
-        uid = str(uuid.uuid4())
-        self.logger.display("Writing file: " + uid, "debug")
-        filelist = open(settings.TMP_FOLDER + uid + ".fl", "w")
-        filelist.write(content)
-        filelist.close()
-        self.user_list_fetched = True
-
-        self.logger.display("Done!", "debug")
+                if not packet:
+                    self.logger.display("Connection closed.", "debug")
+                    break
+                meter.update(len(packet))
+                decompressor.feed(packet)
+                if meter.due():
+                    self.show_rate(meter)
+        except (IOError, ValueError, zlib.error) as e:
+            self.store.discard(filelist)
+            if isinstance(e, ValueError) or not trail:
+                self.logger.display(str(e), "err")
+                return False
+            self.logger.display("Invalid data stream", "err")
+            self.logger.display("Second attempt!", "warn")
+            return self.get_filelist(user, clink, False)
+        if not decompressor.done():
+            # a stalled or closed download is not the user's list
+            self.store.discard(filelist)
+            self.logger.display("Incomplete file list from {}.".format(user),
+                                "err")
+            return False
+        md5sum, new = self.store.add(filelist)
+        if not new:
+            self.logger.display("Known file list: " + md5sum, "debug")
+        with self.stats_lock:
+            self.bytes_received += decompressor.received
+        elapsed = (datetime.now() - start_time).total_seconds()
+        self.history.record(user, self.share(user), decompressor.cid,
+                            decompressor.received / max(elapsed, 0.001))
+        self.metrics.inc('received_bytes_total', decompressor.received)
+        self.metrics.observe('download_bytes_per_second',
+                             decompressor.received / max(elapsed, 0.001))
+        if decompressor.compressed > 0:
+            self.metrics.observe('decompression_ratio',
+                                 float(decompressor.size) /
+                                 decompressor.compressed)
+
+        self.logger.display("Done! {:.1f} recv calls per MB.".format(
+                            receiver.calls_per_mb()), "debug")
 
         elapsed_time = str((datetime.now() - start_time).total_seconds())
         self.logger.display("Elapsed time: " + elapsed_time, "debug")
 
-        # write user-list mapping
-        uf_map = open(settings.TMP_FOLDER + "umap", "a")
-        md5sum = hashlib.md5(settings.TMP_FOLDER + uid + ".fl").hexdigest()
+        if self.pipeline is not None:
+            self.pipeline.put(printable(user), md5sum, elapsed_time,
+                              filelist.size, filelist.data())
+            return True
+
+        # write user-list mapping, the list is found by its md5 hash
+        uf_map = open(settings.TMP_FOLDER + "umap", "a",
+                      encoding=settings.HUB_ENCODING,
+                      errors='surrogateescape')
         uf_map.write(user + "|" +
-                     uid + "|" +
+                     md5sum + "|" +
                      md5sum + "|" +
                      elapsed_time + "\n")
         uf_map.close()
+        return True
 
     def fetch_users(self, sock):
         """Fetches users from Nicklist if it is found and
@@ -266,72 +475,200 @@ class DCbot:
         """
         self.logger.display("Fetching userlist using method 'fetch_users'.",
                             "mesg")
-        # exeprimentary: timeout initial message(s)
-        s_msg = ""
-        user_fetch_time = time.time() + 1.0
-        while True:
+        received = []
+
+        def skipped(command):
+            received.append(command)
+            info = self.dc.parse_myinfo(command)
+            if info is not None:
+                self.users_info[info['nick']] = info
+            self.dc.handle_response_restrictions(command)
+
+        # the nick list is complete when its '|' arrived
+        deadline = time.time() + settings.NICKLIST_TIMEOUT
+        try:
+            nicklist = self.dc.hub.wait_for((b"$NickList", b"$ForceMove "),
+                                            deadline, skipped)
+        except socket.timeout:
+            # that's sad
+            self.logger.display("I didn't find any friends!", "warn")
+            return [], b"|".join(received)
+        if nicklist.startswith(b"$ForceMove "):
+            skipped(nicklist)
+            return [], b"|".join(received)
+        received.append(nicklist)
+        if self.dc.operators is None:
+            # chat of users is told apart from now on
+            self.dc.operators = set()
+        # $OpList and the $MyINFOs follow the $NickList, they are complete
+        # when the hub is quiet for NICKLIST_QUIET seconds
+        while self.dc.redirect is None:
             try:
-                s_msg += sock.recv(settings.BUFFER_SIZE)
-                if time.time() >= user_fetch_time:
-                    break
-            except Exception:
+                skipped(self.dc.hub.read(
+                    min(deadline, time.time() + settings.NICKLIST_QUIET)))
+            except socket.timeout:
                 break
-        self.dc.handle_response_restrictions(s_msg)
-        userlist = []
-        try:
-            for msg in s_msg.split('|'):
-                if "NickList" in msg:
-                    userlist = msg
-                if "OpList" in msg:
-                    oplist = msg
-            if userlist is None:
-                # that's sad, just exit!
-                self.logger.display("I didn't find any friends!", "warn")
-                exit(0)
-            if oplist is None:
-                oplist = []
-            userlist = userlist.split(' ')[1].split('$$')[:-1]
-            # cleanup user, operators and bots
-            userlist.remove(self.nick)
-            for bot in oplist.split(' ')[1].split('$$'):
-                if bot != '':
-                    userlist.remove(bot)
-            return userlist, s_msg
-        except Exception:
-            self.logger.display("Could not retrieve list.", "err")
-            return [], s_msg
-
-    def h_rate(self, start, size):
-        total = (time.time() - start)
-        if int(total) == 0:
-            total = 0.00001
-        speed, r = str(math.ceil(
-            (settings.BUFFER_SIZE / total / 1024) * 100) / 100), "B"
-
-        if int(speed.split(".")[0]) > 100:
-            speed, r = str(math.ceil((float(speed)/1024) * 100) / 100), "KB"
-            if int(speed.split(".")[0]) > 100:
-                speed, r = str(math.ceil(
-                    (float(speed)/1024) * 100) / 100), "MB"
-
-        # dynamic timeout adjustment
-        if r == "B":
-            settings.CLIENT_TIMEOUT = 0.1
-        elif r == "KB":
-            settings.CLIENT_TIMEOUT = 0.05
-        elif r == "MB":
-            settings.CLIENT_TIMEOUT = 0.001
-
-        speed = "{} {}/s \r".format(speed, r)
-        time.sleep(0.5)
-        sys.stdout.flush()
+        userlist = [decode(user) for user in
+                    nicklist.partition(b' ')[2].split(b'$$') if user != b'']
+        # cleanup user, operators and bots
+        self.bots = set([self.nick])
+        for command in received:
+            if command.startswith(b"$OpList"):
+                self.bots.update(decode(command.partition(b' ')[2])
+                                 .split('$$'))
+        userlist = [user for user in userlist if user not in self.bots]
+        return userlist, b"|".join(received)
+
+    def watch_hub(self, crawler, userlist):
+        """Read the hub connection while the crawler runs, so that hub
+        warnings slow down the requests. In daemon mode it maintains the
+        set of online users until the hub disconnects: users that join
+        or announce a new share size in $MyINFO are queued in the
+        crawler, users that $Quit are dropped. An empty command is sent
+        as keepalive when the hub is silent for KEEPALIVE_INTERVAL
+        seconds. It returns when the hub redirects.\n
+        Args:
+            crawler (Crawler): The running crawler.
+            userlist (list): Users from the nick list.
+        """
+        online = set(userlist)
+        if self.daemon:
+            self.logger.display("Watching hub for new users.", "mesg")
+        keepalive = time.time() + settings.KEEPALIVE_INTERVAL
+        while self.daemon or crawler.running():
+            self.export_metrics()
+            try:
+                command = self.dc.hub.read(min(keepalive, time.time() + 1))
+            except socket.timeout:
+                if time.time() >= keepalive:
+                    self.dc.keep_alive(self.sock)
+                    keepalive = time.time() + settings.KEEPALIVE_INTERVAL
+                continue
+            except socket.error:
+                self.logger.display("Lost connection to hub.", "warn")
+                return
+            keepalive = time.time() + settings.KEEPALIVE_INTERVAL
+            self.dc.handle_response_restrictions(command)
+            if self.dc.redirect is not None:
+                # the crawl is aborted, the bot reconnects afterwards
+                return
+            if command.startswith(b"$MyINFO"):
+                info = self.dc.parse_myinfo(command)
+                if info is None or info['nick'] in self.bots or \
+                   not self.in_shard(info['nick']):
+                    continue
+                user = info['nick']
+                known = user in self.users_info
+                self.users_info[user] = info
+                if self.daemon and user not in online:
+                    online.add(user)
+                    self.users_found += 1
+                if self.daemon and ((self.force and not known) or
+                                    not self.history.unchanged(
+                                        user, info['share'])):
+                    crawler.add(user)
+            elif command.startswith(b"$Hello "):
+                # the $MyINFO of the new user follows
+                user = decode(command.partition(b' ')[2])
+                if self.daemon and user not in online and \
+                   user not in self.bots and self.in_shard(user):
+                    online.add(user)
+                    self.users_found += 1
+            elif command.startswith(b"$Quit "):
+                user = decode(command.partition(b' ')[2])
+                online.discard(user)
+                crawler.discard(user)
+            elif command.startswith(b"$OpList "):
+                self.bots.update(decode(command.partition(b' ')[2])
+                                 .split('$$'))
+
+    def export_metrics(self, final=False):
+        """Write the metrics file, at most every METRICS_INTERVAL
+        seconds.\n
+        Args:
+            final (bool): Write it now, the crawl is over.
+        """
+        if not self.metrics_file:
+            return
+        if not final and \
+           time.time() - self.metrics_written < settings.METRICS_INTERVAL:
+            return
+        self.metrics_written = time.time()
+        self.metrics.write(self.metrics_file)
+
+    def write_summary(self, perc):
+        """Write a JSON summary of the crawl of this hub to RUNS_FOLDER,
+        named by hub and start time.\n
+        Args:
+            perc (string): Percentage of users whose lists are known.
+        """
+        if not settings.RUNS_FOLDER:
+            return
+        if not os.path.exists(settings.RUNS_FOLDER):
+            os.makedirs(settings.RUNS_FOLDER)
+        summary = {'hub': "{}:{}".format(self.host, self.port),
+                   'shard': "{}/{}".format(*self.shard),
+                   'start': self.start_time,
+                   'elapsed': time.time() - self.start_time,
+                   'found': self.users_found, 'fetched': self.user_count,
+                   'skipped': self.skipped, 'resumed': self.resumed,
+                   'percentage': float(perc),
+                   'bytes': self.bytes_received,
+                   'metrics': self.metrics.summary()}
+        name = "{}_{}_{}".format(self.host, self.port,
+                                 time.strftime("%Y%m%d-%H%M%S",
+                                               time.localtime(
+                                                   self.start_time)))
+        if self.shard[1] > 1:
+            name += "_{}-{}".format(*self.shard)
+        with open(os.path.join(settings.RUNS_FOLDER, name + ".json"),
+                  "w") as summary_file:
+            json.dump(summary, summary_file, indent=1, sort_keys=True)
+
+    def in_shard(self, user):
+        """Check if a user belongs to the shard of this crawler. Users
+        are spread by a hash of their nick, so every crawler of the hub
+        agrees without talking to the others.\n
+        Args:
+            user (string): Username.
+        Returns:
+            Boolean: True if this crawler fetches the user.
+        """
+        k, n = self.shard
+        return n == 1 or (binascii.crc32(encode(user)) & 0xffffffff) % n == k
+
+    def priority(self, user):
+        """Get the fetch priority of a user from its $MyINFO and its
+        history, see FETCH_ORDER.\n
+        Args:
+            user (string): Username.
+        Returns:
+            The priority, higher is fetched earlier.
+        """
+        return share_priority(self.users_info.get(user),
+                              self.history.entry(user))
+
+    def share(self, user):
+        """Get the share size a user announced in $MyINFO.\n
+        Args:
+            user (string): Username.
+        Returns:
+            The share size as string, None if it is unknown.
+        """
+        info = self.users_info.get(user)
+        if info is None:
+            return None
+        return info['share']
+
+    def show_rate(self, meter):
+        """Display the download rate of a connection.\n
+        Args:
+            meter (RateMeter): The rate meter of the download.
+        """
         sys.stdout.write("\033[94m"
                          "[down]:\t\t "
-                         "Downloading at " + speed + "\033[0m",)
+                         "Downloading at " + meter.format() + " \r\033[0m")
         sys.stdout.flush()
 
-    def empty_thread_skeleton(self):
-        pass
-
 if __name__ == '__main__':
     bot = DCbot()
@@ -1,29 +1,92 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
 #   2017 - Mahdi Enan and Florian Platzer
 
 import argparse
+import multiprocessing
 import os
+import sys
+import time
 
 import settings
 
+from dcbot import DCbot, write_servinfo
+from utils.connection import Connector
 from utils.fileParser import FileParser
 from utils.logs import Logger
 
+cc_port = None  # c2c port of this worker process
+bind = None  # source address of this worker process
+
+
+def init_worker(slots):
+    """Initialize a worker process of the hub pool and reserve its
+    c2c port and source address, so that hubs crawled at the same time
+    do not collide.\n
+    Args:
+        slots (Queue): Free (c2c port, source address) pairs.
+    """
+    global cc_port, bind
+    cc_port, bind = slots.get()
+
+
+def crawl_hub(job):
+    """Crawl a single hub inside a worker process.\n
+    Args:
+        job (dict): Hub address and port, shard, dcbot arguments.
+    Returns:
+        summary (dict): Address, port, users found, fetched, skipped and
+        resumed, received bytes and elapsed time of the hub (shard).
+    """
+    hub = job['hub']
+    summary = {'address': hub['address'], 'port': hub['port'].strip(),
+               'found': 0, 'fetched': 0, 'skipped': 0, 'resumed': 0,
+               'bytes': 0, 'ok': False}
+    argv = ['-a', summary['address'], '-p', summary['port'],
+            '--cc_port', str(cc_port)] + job['argv']
+    if job['shards'] > 1:
+        argv += ['--shard', "{}/{}".format(job['shard'], job['shards'])]
+    if bind is not None:
+        argv += ['--bind', bind]
+    start = time.time()
+    bot = None
+    try:
+        bot = DCbot(argv)
+        summary['ok'] = True
+    except SystemExit:
+        pass  # hub refused us, see log
+    except Exception as e:
+        Logger(True, False).display(summary['address'] + ": " + str(e),
+                                    "err")
+    # pool workers exit without atexit handlers
+    Logger(True, False).flush()
+    if bot is not None:
+        summary['found'] = bot.users_found
+        summary['fetched'] = bot.user_count
+        summary['skipped'] = bot.skipped
+        summary['resumed'] = bot.resumed
+        summary['bytes'] = bot.bytes_received
+    summary['elapsed'] = time.time() - start
+    return summary
+
 
 class Main:
 
     def __init__(self):
         self.logger = Logger(True, False)
+        if not os.path.exists(settings.TMP_FOLDER):
+            os.makedirs(settings.TMP_FOLDER)
+        if not os.path.exists('debug/'):
+            os.makedirs('debug/')
         self.parse_args()
         self.fileParser = FileParser()
         self.scan_hub_list()
         if self.parser is True:
-            command = 'python manage.py --parse_filelists'
+            command = sys.executable + ' manage.py --parse_filelists'
             os.system(command)
         if self.stat is True:
-            command = 'python manage.py --statistics'
+            command = sys.executable + ' manage.py --statistics'
             os.system(command)
 
     def parse_args(self):
@@ -38,23 +101,153 @@ class Main:
                             help="Create statistics and "
                             "afterwards statistics.html",
                             action='store_true')
+        parser.add_argument("--workers", type=int,
+                            default=settings.HUB_WORKERS,
+                            help="Number of hubs crawled at the same time")
+        parser.add_argument("--concurrency", type=int,
+                            help="Number of users fetched in parallel "
+                                 "on each hub")
+        parser.add_argument("--ip", help="Ip address users connect to, "
+                                         "discovered if not given")
+        parser.add_argument("--force", help="Fetch lists of unchanged "
+                                            "users as well",
+                            action='store_true')
+        parser.add_argument("--resume", help="Continue interrupted "
+                                             "crawls of the hubs",
+                            action='store_true')
+        parser.add_argument("--shards", type=int, default=1,
+                            help="Number of crawlers sharing the users "
+                                 "of each hub")
+        parser.add_argument("--interfaces",
+                            help="Comma separated interfaces or source "
+                                 "addresses, spread over the workers")
 
         args = parser.parse_args()
         self.parser = args.p
         self.stat = args.s
+        self.workers = max(1, args.workers)
+        self.shards = max(1, args.shards)
+        self.sources = [None]
+        if args.interfaces:
+            connector = Connector(self.logger, False)
+            self.sources = [connector.source_address(source.strip())
+                            for source in args.interfaces.split(",")
+                            if source.strip()]
+            # use every address at least once
+            self.workers = max(self.workers, len(self.sources))
+        self.argv = ['-v']
+        if args.concurrency is not None:
+            self.argv += ['-c', str(args.concurrency)]
+        if args.ip is not None:
+            self.argv += ['--ip', args.ip]
+        if args.force:
+            self.argv += ['--force']
+        if args.resume:
+            self.argv += ['--resume']
 
     def scan_hub_list(self):
-        """Starts dcBot for each hub address in the hublist file with
-        python dcbot.py -v -a [ADDRESS] -p [PORT]
+        """Crawls all hubs in the hublist file with a pool of worker
+        processes, each running dcBot for one hub (shard) at a time on
+        its own c2c port. With several interfaces the workers are spread
+        over their source addresses. The users of a hub can be split
+        into shards that are crawled by different workers, their hub
+        information is merged afterwards.
         """
         if not os.path.isfile(settings.HUB_LIST):
             self.logger.display("No hub list file in data/ found!", "err")
             return
         self.hubs = self.fileParser.parse_hubs(settings.HUB_LIST)
-        for hub in self.hubs:
-            command = 'python dcbot.py -v -a ' + hub['address'] + ' -p ' + hub['port']
-            print(command)
-            os.system(command)
+        if len(self.hubs) == 0:
+            return
+        # discover the ip once for all hubs, with several source
+        # addresses each worker announces its own. Without PUBLIC_IP or
+        # the interface each dcBot takes the address of its hub socket.
+        if '--ip' not in self.argv and self.sources == [None]:
+            ip = Connector(self.logger, False).get_public_ip()
+            if ip is not None:
+                self.argv += ['--ip', ip]
+        jobs = [{'hub': hub, 'argv': self.argv, 'shard': shard,
+                 'shards': self.shards}
+                for hub in self.hubs for shard in range(self.shards)]
+        workers = min(self.workers, len(jobs))
+        slots = multiprocessing.Queue()
+        for worker in range(workers):
+            slots.put((settings.CC_PORT + worker,
+                       self.sources[worker % len(self.sources)]))
+
+        start = time.time()
+        summaries = []
+        pool = multiprocessing.Pool(workers, init_worker, (slots,))
+        try:
+            for summary in pool.imap_unordered(crawl_hub, jobs):
+                summaries.append(summary)
+                self.logger.display("[{}/{}] {}:{} fetched {} of {} "
+                                    "users.".format(len(summaries),
+                                                    len(jobs),
+                                                    summary['address'],
+                                                    summary['port'],
+                                                    summary['fetched'],
+                                                    summary['found']),
+                                    "info")
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        if self.shards > 1:
+            self.merge_shards(summaries)
+        self.show_summary(summaries, time.time() - start)
+
+    def merge_shards(self, summaries):
+        """Writes the hub information of sharded hubs, combined from the
+        summaries of all their shards.\n
+        Args:
+            summaries (array): One dict for each shard (see crawl_hub).
+        """
+        hubs = {}
+        for summary in summaries:
+            if not summary['ok']:
+                continue
+            hub = hubs.setdefault((summary['address'], summary['port']),
+                                  {'found': 0, 'known': 0})
+            hub['found'] += summary['found']
+            # like dcbot, lists fetched before a resume are known
+            hub['known'] += summary['fetched'] + summary['skipped'] + \
+                summary['resumed']
+        for (address, port), hub in sorted(hubs.items()):
+            perc = 0
+            if hub['found'] > 0:
+                perc = str(100.0 * hub['known'] / hub['found'])[:5]
+            write_servinfo(address, port, perc)
+
+    def show_summary(self, summaries, elapsed):
+        """Prints the combined result of all crawled hubs.\n
+        Args:
+            summaries (array): One dict for each hub (see crawl_hub).
+            elapsed (float): Total crawl time in seconds.
+        """
+        found = sum(summary['found'] for summary in summaries)
+        fetched = sum(summary['fetched'] for summary in summaries)
+        skipped = sum(summary['skipped'] for summary in summaries)
+        resumed = sum(summary['resumed'] for summary in summaries)
+        megabytes = sum(summary['bytes'] for summary in summaries) \
+            / (1024.0 * 1024.0)
+        # shards of a hub count once
+        hubs = set((summary['address'], summary['port'])
+                   for summary in summaries)
+        failed = set((summary['address'], summary['port'])
+                     for summary in summaries if not summary['ok'])
+        elapsed = max(elapsed, 0.001)
+        self.logger.display("Crawled {} hubs ({} failed) in {:.1f}s.".
+                            format(len(hubs), len(failed), elapsed), "ok")
+        self.logger.display("Fetched {} of {} user lists ({} unchanged, "
+                            "{} resumed), {:.2f} MB.".format(
+                                fetched, found, skipped, resumed,
+                                megabytes), "ok")
+        self.logger.display("Throughput: {:.2f} users/s, {:.3f} MB/s.".
+                            format(fetched / elapsed, megabytes / elapsed),
+                            "ok")
 
 
 if __name__ == '__main__':
@@ -1,29 +1,63 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
 #   2017 - Mahdi Enan and Florian Platzer
 import argparse
 import glob
+import multiprocessing
 import os
-import hashlib
+import time
+
+from collections import OrderedDict, deque
 
 import settings
 
 from utils.backend import Database
 from utils.fileListParser import FileListParser
 from utils.fileParser import FileParser
+from utils.ingest import Ingest
 from utils.statistics import Statistics
+from utils.store import ListStore
 from utils.logs import Logger
 
+worker_parser = None  # FileListParser of this parse worker
+worker_store = None  # ListStore of this parse worker
+
+
+def init_worker():
+    """Initialize a parse worker process. The file type table is read
+    from its cache, see FileTypeParser.load.
+    """
+    global worker_parser, worker_store
+    worker_parser = FileListParser()
+    worker_store = ListStore()
+
+
+def parse_list(md5sum):
+    """Parse a list of the store inside a parse worker.\n
+    Args:
+        md5sum (string): md5 hash of the list.
+    Returns:
+        (string, int, ParsedFilelist): md5 hash, size and the parsed
+        list, None if it is invalid.
+    """
+    filelist = worker_store.open(md5sum)
+    try:
+        return md5sum, worker_store.size(md5sum), \
+            worker_parser.parseFilelist(filelist)
+    finally:
+        filelist.close()
+
 
 class Manage:
 
     def __init__(self):
         self.logger = Logger(True, False)
         self.parse_args()
-        self.xmlP = FileListParser()
         self.fileParser = FileParser()
         self.db = Database()
+        self.store = ListStore()
+        self.ingest = Ingest(self.db, self.logger)
         self.stat_instance = Statistics()
 
         if self.parser is True:
@@ -43,10 +77,15 @@ class Manage:
                             help="Create statistics and "
                             "afterwards statistics.html",
                             action='store_true')
+        parser.add_argument("--workers", type=int,
+                            default=settings.PARSE_WORKERS,
+                            help="number of processes parsing file lists, "
+                                 "the database is written by this one")
 
         args = parser.parse_args()
         self.parser = args.parse_filelists
         self.stat = args.statistics
+        self.workers = max(1, args.workers)
 
     #############################
     # ### XML parser stuff #### #
@@ -54,6 +93,9 @@ class Manage:
 
     def parse_filelist(self):
         """Parses downloaded filelists of users.\n
+        Lists are read from the list store, each distinct list only once.
+        With several workers the lists are parsed in a process pool and
+        inserted here, so only one process writes the database.
         """
 
         if not settings.REMOVE_TMP_FILES:
@@ -62,52 +104,98 @@ class Manage:
         # parse umap first!
         self.parse_umap()
 
-        # all files in TMP_FOLDER
-        files = glob.glob(settings.TMP_FOLDER + "*")
-        fl_counter = len(glob.glob(settings.TMP_FOLDER + "*.fl"))
-        if not fl_counter > 0:
+        # hub information in TMP_FOLDER
+        for f in glob.glob(settings.TMP_FOLDER + "*servinfo"):
+            hubs = self.fileParser.parse_servinfo(f)
+            for hub in hubs:
+                self.ingest.insert_hub_into_db(hub)
+
+        # every distinct list is parsed once, however many users sent it
+        md5sums = OrderedDict()
+        for umap in self.umaps:
+            md5sums.setdefault(umap['md5sum'], []).append(umap['user'])
+        if not len(md5sums) > 0:
             self.logger.display("No filelist in \'" + settings.TMP_FOLDER +
-                                "\' found!", "warn")
+                                "umap\' found!", "warn")
             return
 
         self.logger.display('Parsing may take several minutes depending ' +
                             'on the size of each file list!', 'warn')
-        counter = 1
-        for f in files:
-            # parse all file lists
-            if '.fl' in f:
-                md5sum = hashlib.md5(f).hexdigest()
-                self.logger.display('Parsing: Filelist ' +
-                                    str(counter) + ' of ' +
-                                    str(fl_counter) + '...', 'debug')
-                counter += 1
-                if self.is_filelist_in_DB(md5sum):
-                    self.logger.display('Skipping. User\'s file list already '
-                                        'in DB.', 'debug')
-                    continue
-                filelist_size = os.path.getsize(f)
-                parsed_filelist = self.xmlP.parseFilelist(f)
-                if len(parsed_filelist) < 1:
-                    continue
-
-                self.insert_files_into_db(parsed_filelist, f.split('/')[1],
-                                          filelist_size)
-            # parse servinfo file
-            elif 'servinfo' in f:
-                hubs = self.fileParser.parse_servinfo(f)
-                for hub in hubs:
-                    self.insert_hub_into_db(hub)
-            # ignore all others
+        new = []
+        for md5sum, users in md5sums.items():
+            if self.ingest.is_filelist_in_DB(md5sum):
+                # the same list from another user, hub or crawl
+                cid = self.db.get_cid_from_md5(md5sum)[0][0]
+                self.db.begin_transaction()
+                self.ingest.insert_users_into_db(md5sum, cid, users)
+                self.db.end_transaction()
+            elif self.store.contains(md5sum):
+                new.append(md5sum)
             else:
-                pass
+                self.logger.display('File list ' + md5sum + ' not in '
+                                    'store!', 'warn')
+        self.logger.display('Skipped {} file lists already in DB.'.format(
+                            len(md5sums) - len(new)), 'debug')
+
+        start = time.time()
+        files = 0
+        results = self.parse_lists(new)
+        for counter, (md5sum, filelist_size, parsed_filelist) in \
+                enumerate(results, 1):
+            self.logger.display('Parsed: Filelist ' +
+                                str(counter) + ' of ' +
+                                str(len(new)) + '.', 'debug')
+            if parsed_filelist is None:
+                continue
+
+            self.db.begin_transaction()
+            self.ingest.insert_files_into_db(parsed_filelist, md5sum,
+                                             filelist_size, md5sums[md5sum])
+            self.db.end_transaction()
+            files += len(parsed_filelist)
+        elapsed = max(time.time() - start, 0.001)
+        self.logger.display('Inserted {} file lists with {} files in '
+                            '{:.1f}s, {:.0f} files/s ({} workers).'.format(
+                                len(new), files, elapsed, files / elapsed,
+                                self.workers), 'ok')
 
         if settings.REMOVE_TMP_FILES:
             self.remove_all_tmpfiles()
 
+    def parse_lists(self, md5sums):
+        """Parse lists of the store, in a pool of 'workers' processes
+        if there is more than one. At most two lists per worker wait for
+        the database, so memory stays bounded.\n
+        Args:
+            md5sums (list): md5 hashes of the lists.
+        Returns:
+            Iterator over (md5sum, size, ParsedFilelist), in the order
+            of md5sums.
+        """
+        if self.workers == 1:
+            init_worker()
+            for md5sum in md5sums:
+                yield parse_list(md5sum)
+            return
+        pool = multiprocessing.Pool(self.workers, init_worker)
+        try:
+            waiting = deque(md5sums)
+            running = deque()
+            while waiting or running:
+                while waiting and len(running) < 2 * self.workers:
+                    running.append(pool.apply_async(parse_list,
+                                                    (waiting.popleft(),)))
+                yield running.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     def parse_umap(self):
         """Insert umap informations into database. A file that maps:
-        (username|checksum|md5sum|elapsed_time).
+        (username|md5sum|md5sum|elapsed_time).
         """
+        self.umaps = []
         if not os.path.isfile(settings.TMP_FOLDER + 'umap'):
             self.logger.display("No umap file in \'" + settings.TMP_FOLDER +
                                 "\' found!", "warn")
@@ -115,10 +203,10 @@ class Manage:
         self.umaps = self.fileParser.parse_umap(settings.TMP_FOLDER + 'umap')
         for umap in self.umaps:
             # check if, filelist is already in DB
-            if not self.is_filelist_in_DB(umap['md5sum']):
-                self.insert_filelist_into_db({'md5sum': umap['md5sum'],
-                                             'elapsed_time':
-                                              umap['elapsed_time']})
+            if not self.ingest.is_filelist_in_DB(umap['md5sum']):
+                self.ingest.insert_filelist_into_db(
+                    {'md5sum': umap['md5sum'],
+                     'elapsed_time': umap['elapsed_time']})
 
     def remove_all_tmpfiles(self):
         """Removes all tmp files after parsing.
@@ -128,82 +216,6 @@ class Manage:
             os.remove(os.path.join(settings.TMP_FOLDER, f))
         self.logger.display("All tmp files removed.", "debug")
 
-    #############################
-    # ### Database stuff ###### #
-    ############################
-
-    def is_filelist_in_DB(self, md5sum):
-        """Checks if user's file list is already in DB.\n
-        Args:
-            md5sum (string): md5 hash of file list.
-        Returns:
-            Boolean: True if user's file list is already in DB, False else.
-        """
-        if len(self.db.get_user_ID_from_md5(md5sum)) > 0:
-            return True
-        return False
-
-    def insert_files_into_db(self, parsed_filelist, filename, filelist_size):
-        """Inserts filelist information into database.\n
-        Args:
-            parsed_filelist (string): The filelist data.
-            filename (string): The filename.
-            filelist_size (string): The file size.
-        """
-        username = 'unknown'
-        md5sum = 'unknown'
-        for umap in self.umaps:
-            if umap['uid'] == filename[:-3]:
-                username = umap['user']
-                md5sum = umap['md5sum']
-                break
-        CID = parsed_filelist[0]
-        dic = parsed_filelist[1]
-        # insert all files and corresponding paths
-        files = []
-        self.db.begin_transaction()
-        for file in dic:
-            path = dic[file]['path']
-            size = dic[file]['size']
-            type = dic[file]['type']
-            category = dic[file]['category']
-            name = dic[file]['filename']
-            # insert path only if it is not in db already
-            if len(self.db.get_pathID(path)) == 0:
-                self.db.add_path((path,))
-            pathID = self.db.get_pathID(path)[0][0]
-            files.append((name, type, category, size, pathID))
-        self.db.add_files(files)
-
-        # insert user & update filelist size
-        self.db.add_user(username, md5sum, CID)
-        self.db.update_filelist_size(filelist_size, md5sum)
-        self.db.end_transaction()
-        self.logger.display("Done.", "debug")
-
-    def insert_hub_into_db(self, hub_info):
-        """Insert hub only if it is not in db already.\n
-        Args:
-            hub_info (string): Hub information\n
-            (name|port|percentage of filelists feched|minShare|registration):
-        """
-        if len(self.db.get_hubID(hub_info['name'], hub_info['port'])) == 0:
-            self.db.add_hub(hub_info['name'], hub_info['port'],
-                            hub_info['fetched'], hub_info['min_share'],
-                            hub_info['reg'])
-            self.db.commit()
-
-    def insert_filelist_into_db(self, filelist_info):
-        """Insert filelist only if it is not in db already.\n
-        Args:
-            filelist_info (string): Filelist information\n
-            (md5sum|elapsed_time)
-        """
-        if len(self.db.get_filelist_ID(filelist_info['md5sum'])) == 0:
-            self.db.add_filelist(filelist_info['md5sum'],
-                                 filelist_info['elapsed_time'])
-            self.db.commit()
-
     #############################
     # ### Statistic stuff ###### #
     ############################
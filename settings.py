@@ -1,26 +1,88 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
 #   2017 - Mahdi Enan and Florian Platzer
 
 
 # Network settings
-NIC = "tun0"  # Network device; eth0, enp0s3, wlp3s0 ->!! Currently not used !!
-BUFFER_SIZE = 1024
-CLIENT_TIMEOUT = 5.0
-CC_PORT = 40000
+NIC = "tun0"  # Network device; eth0, enp0s3, wlp3s0; used for IP_SOURCE
+BUFFER_SIZE = 1024  # protocol messages
+HUB_ENCODING = 'utf-8'  # nicks and hub text, invalid bytes are kept as is
+RECV_MIN_SIZE = 4096  # file list downloads start with this chunk size
+RECV_MAX_SIZE = 256 * 1024  # and grow up to this one
+CLIENT_TIMEOUT = 5.0  # longest wait for data of a user
+MIN_CLIENT_TIMEOUT = 1.0  # shortest wait, used on fast connections
+TIMEOUT_FACTOR = 10  # wait up to 10x the time a chunk takes at the rate
+RATE_ALPHA = 0.3  # weight of the newest sample in the download rate
+HANDSHAKE_TIMEOUT = 10.0  # seconds a hub or user has to finish a handshake
+NICKLIST_TIMEOUT = 30.0  # seconds to wait for the complete $NickList
+NICKLIST_QUIET = 1.0  # silence that ends the $OpList/$MyINFOs after it
+KEEPALIVE_INTERVAL = 60.0  # daemon mode: keepalive after a silent minute
+CC_PORT = 40000  # single port of the shared c2c listener
+CONNECT_TIMEOUT = 10.0  # seconds a user has to answer a $ConnectToMe
+LISTEN_BACKLOG = 128
+CONCURRENCY = 1  # users fetched in parallel
+FETCH_ORDER = 'priority'  # 'priority' (large, active, reliable first) or 'nicklist'
+MAX_RETRIES = 2  # retries of a failed user per crawl
+RETRY_DELAY = 30.0  # seconds before the first retry, doubled each time
+
+# Rate of $ConnectToMe requests. Halved (CTM_BACKOFF) when the hub warns,
+# kicks or redirects, raised by CTM_INCREASE after CTM_QUIET quiet seconds.
+CTM_RATE = 5.0  # initial requests per second
+HUB_RATES = {}  # initial rate per hub, e.g. {'hub.example.org:411': 2.0}
+CTM_MIN_RATE = 0.2
+CTM_MAX_RATE = 50.0
+CTM_BURST = 5
+CTM_BACKOFF = 0.5
+CTM_INCREASE = 0.5
+CTM_QUIET = 10.0
+HUB_WARNINGS = ['flood', 'too fast', 'too many', 'slow down', 'spam',
+                'kicked', 'banned']
+HUB_WORKERS = 4  # hubs (shards) crawled in parallel by main.py, CC_PORT + n
+
+# Ip announced in $ConnectToMe: 'config' (PUBLIC_IP), 'interface' (NIC,
+# or PUBLIC_IP when set) or 'lookup' (opt-in, asks IP_LOOKUP_URL over the
+# network). Discovered once, cached IP_CACHE_TTL seconds.
+IP_SOURCE = 'interface'
+PUBLIC_IP = None
+IP_LOOKUP_URL = 'http://ip.42.pl/raw'
+IP_LOOKUP_TIMEOUT = 5.0
+IP_CACHE_TTL = 3600
 
 # Database settings
 DATABASE_NAME = 'dc.db'
 
 # Log settings
 LOG_FILE = "debug/debug.txt"
+LOG_FORMAT = 'text'  # 'text' or 'json' (one JSON object per line)
+LOG_FLUSH_INTERVAL = 1.0  # seconds between flushes of the log file
 
 # Folder and File settings
 TMP_FOLDER = 'tmp/'
 STATFILES = TMP_FOLDER
+MAX_FILELIST_SIZE = 512 * 1024 * 1024  # inflated bytes, stops memory bombs
 FILETYPES = 'data/file_types.xml'
+FILETYPES_CACHE = 'data/file_types.cache'  # compiled FILETYPES
 HUB_LIST = 'data/hublist.txt'
+HISTORY_FOLDER = 'data/history/'  # share size and CID of fetched users
+CHECKPOINT_FOLDER = 'data/checkpoints/'  # progress of running crawls
+STORE_FOLDER = 'data/store/'  # file lists named by md5 of their content
+STORE_COMPRESSION = 'bz2'  # lists on disk: 'bz2' (as received) or None (xml)
+
+# Metrics of a crawl, see utils/metrics.py
+METRICS_FILE = None  # Prometheus text file, e.g. for the node exporter
+METRICS_PORT = None  # local port serving /metrics, e.g. 9470
+METRICS_INTERVAL = 10.0  # seconds between writes of METRICS_FILE
+RUNS_FOLDER = 'data/runs/'  # JSON summary per hub crawl, None disables
+
+# dcbot --pipeline: parse lists and fill the database while crawling
+PIPELINE_WORKERS = 2  # parser threads
+PIPELINE_QUEUE = 8  # lists waiting for a parser; crawling waits if full
+PIPELINE_BATCH = 16  # lists inserted in one database transaction
+PIPELINE_INLINE_SIZE = 32 * 1024 * 1024  # larger lists are read from store
+
+# manage.py --parse_filelists
+PARSE_WORKERS = 1  # parser processes, only the main process writes the DB
 
 # Remove all tmp files after executing parsing
 REMOVE_TMP_FILES = True
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
@@ -9,7 +9,7 @@
 import sqlite3
 import settings
 
-from logs import Logger
+from utils.logs import Logger
 
 
 class Database:
@@ -112,7 +112,7 @@ class Database:
     def add_files(self, files):
         """Insert files into database.\n
         Args:
-            files (array): A Array with tupels:
+            files (iterable): Tupels:
                         (name, type, category, size, pathID).
         """
         self.cursor.executemany("INSERT INTO files \
@@ -214,4 +214,38 @@ class Database:
         user_ID = self.cursor.fetchall()
         return user_ID
 
+    def get_user_ID(self, nickname, md5sum):
+        """Get the user ID (PK) of a user with a file list.\n
+        Args:
+            nickname (string): User nickname.
+            md5sum (string): md5 hash of the file list.
+        Returns:
+            user_ID (int): The user ID of the user.
+        """
+        self.cursor.execute("SELECT userID FROM users WHERE nickname=? "
+                            "AND filelist=?", (nickname, md5sum))
+        user_ID = self.cursor.fetchall()
+        return user_ID
+
+    def get_cid_from_md5(self, md5sum):
+        """Get the CID of a file list from the users that sent it.\n
+        Args:
+            md5sum (string): md5 hash of the file list.
+        Returns:
+            cid (string): The CID of the file list.
+        """
+        self.cursor.execute("SELECT cid FROM users WHERE filelist=? "
+                            "LIMIT 1", (md5sum,))
+        cid = self.cursor.fetchall()
+        return cid
+
+    def get_md5sums(self):
+        """Get the md5 hashes of all file lists that have users.\n
+        Returns:
+            md5sums (array): One tuple (md5sum,) for each file list.
+        """
+        self.cursor.execute("SELECT DISTINCT filelist FROM users")
+        md5sums = self.cursor.fetchall()
+        return md5sums
+
 # db = Database()
@@ -0,0 +1,84 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'checkpoint.py' records the progress of a crawl so it can be resumed.
+
+import os
+import threading
+import settings
+
+
+class Checkpoint():
+
+    def __init__(self, host, port, shard=(0, 1)):
+        """Journal of a running hub crawl in CHECKPOINT_FOLDER. Every
+        change of a user is appended at once (nickname|state), with the
+        states 'pending', 'fetched' and 'failed', so the file survives a
+        kill. It is removed when the crawl is complete.\n
+        Args:
+            host (string): Hub (Server) domain name or ip address.
+            port (int): Hub (Server) port number.
+            shard (tuple): Shard K of N crawled by this process.
+        """
+        name = "{}_{}".format(host, port)
+        if shard[1] > 1:
+            name += "_{}-{}".format(*shard)
+        self.path = os.path.join(settings.CHECKPOINT_FOLDER, name)
+        self.lock = threading.Lock()
+        self.file = None
+
+    def open(self, resume):
+        """Start the journal of a crawl.\n
+        Args:
+            resume (bool): Continue the crawl of an existing checkpoint,
+            otherwise it is discarded.
+        Returns:
+            fetched (set): Users fetched by the interrupted crawl.
+        """
+        states = {}
+        if resume and os.path.isfile(self.path):
+            with open(self.path, encoding=settings.HUB_ENCODING,
+                      errors='surrogateescape') as checkpoint_file:
+                for line in checkpoint_file:
+                    values = line.rstrip("\n").rsplit("|", 1)
+                    if len(values) == 2:
+                        states[values[0]] = values[1]
+        fetched = set(user for user, state in states.items()
+                      if state == 'fetched')
+        if not os.path.exists(settings.CHECKPOINT_FOLDER):
+            os.makedirs(settings.CHECKPOINT_FOLDER)
+        # failed and pending users get another chance and are added again
+        with open(self.path + ".tmp", "w", encoding=settings.HUB_ENCODING,
+                  errors='surrogateescape') as checkpoint_file:
+            for user in fetched:
+                checkpoint_file.write(user + "|fetched\n")
+        os.rename(self.path + ".tmp", self.path)
+        self.file = open(self.path, "a", encoding=settings.HUB_ENCODING,
+                         errors='surrogateescape')
+        return fetched
+
+    def record(self, user, state):
+        """Append the new state of a user.\n
+        Args:
+            user (string): Username.
+            state (string): 'pending', 'fetched' or 'failed'.
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(user + "|" + state + "\n")
+            self.file.flush()
+
+    def close(self, complete):
+        """End the journal.\n
+        Args:
+            complete (bool): The crawl is done, remove the checkpoint.
+            Otherwise it is kept for --resume.
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.file = None
+            if complete:
+                os.remove(self.path)
@@ -4,35 +4,49 @@
 #   'connection.py' handles socket connections with server and clients.
 
 import sys
+import time
 import fcntl
 import socket
 import struct
 import signal
+import settings
+import threading
 
-from urllib2 import urlopen
+from urllib.request import urlopen
+from utils.listener import Listener
+
+# the discovered ip is shared by all hub sessions of the process
+ip_cache = {'ip': None, 'expires': 0}
+ip_lock = threading.Lock()
 
 
 class Connector():
 
-    def __init__(self, logger):
+    def __init__(self, logger, catch_signals=True):
         self.logger = logger
         self.sockets = {}
         self.sock = None  # server socket
+        self.listener = None  # shared c2c listener
 
-        signal.signal(signal.SIGINT, self.signal_handler)
+        if catch_signals:
+            signal.signal(signal.SIGINT, self.signal_handler)
 
-    def open_sock(self, host, port, nic):
+    def open_sock(self, host, port, nic, bind=None):
         """Opens a socket to establish connection with hub.\n
         Args:
             host (string): Hub (Server) domain name or ip address.
             port (string): Hub (Server) port number.
             nic (stirng): The network interface card (depricated).
+            bind (string): Source address of the connection, None lets
+            the system choose.
         Returns:
             A socket for client to server connection.
         """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sockets['hub'] = [self.sock, self.get_public_ip()]
+        self.sockets['hub'] = [self.sock, (host, port)]
         try:
+            if bind:
+                self.sock.bind((bind, 0))
             self.sock.connect((host, port))
         except Exception:
             self.logger.display("No route to host: '{host}:{port}'".
@@ -53,15 +67,68 @@ class Connector():
         return socket.inet_ntoa(fcntl.ioctl(
             s.fileno(),
             0x8915,  # SIOCGIFADDR
-            struct.pack('256s', nic[:15])
+            struct.pack('256s', nic[:15].encode('ascii'))
         )[20:24])
 
-    def get_public_ip(self):
-        """Get the public ip address using 'http://ip.42.pl/raw'.\n
+    def source_address(self, source):
+        """Get the source address for an interface or address.\n
+        Args:
+            source (string): Network interface card or ip address.\n
+        Returns:
+            The ip address of the interface, source itself if it is not
+            an interface.
+        """
+        try:
+            return self.get_ip_address(source)
+        except IOError:
+            return source
+
+    def get_public_ip(self, nic=settings.NIC):
+        """Get the ip address announced to other users. It is discovered
+        once and cached for IP_CACHE_TTL seconds.\n
+        Args:
+            nic (string): The network interface card.\n
+        Returns:
+            The public ip address, None if it is not known yet (see
+            discover_ip).
+        """
+        with ip_lock:
+            if ip_cache['ip'] is None or time.time() > ip_cache['expires']:
+                ip_cache['ip'] = self.discover_ip(nic)
+                ip_cache['expires'] = time.time() + settings.IP_CACHE_TTL
+            return ip_cache['ip']
+
+    def discover_ip(self, nic):
+        """Discover the ip address from the source set in IP_SOURCE:
+            * 'config' uses PUBLIC_IP.
+            * 'interface' uses the address of nic, or PUBLIC_IP when set.
+            * 'lookup' asks IP_LOOKUP_URL, only when opted in.
+        Without a result the interface address is used, then the local
+        address of the hub connection.\n
+        Args:
+            nic (string): The network interface card.\n
         Returns:
-            The public ip address.
+            The ip address, None before the hub is connected if there is
+            no other source.
         """
-        return urlopen('http://ip.42.pl/raw').read()
+        if settings.IP_SOURCE != 'lookup' and settings.PUBLIC_IP:
+            return settings.PUBLIC_IP
+        if settings.IP_SOURCE == 'lookup':
+            try:
+                return urlopen(settings.IP_LOOKUP_URL,
+                               timeout=settings.IP_LOOKUP_TIMEOUT)\
+                    .read().strip().decode('ascii')
+            except Exception:
+                self.logger.display("Could not look up public ip, using "
+                                    "interface address.", "warn")
+        try:
+            return self.get_ip_address(nic)
+        except IOError:
+            pass
+        if self.sock is not None:
+            return self.sock.getsockname()[0]
+        # the host name often resolves to the loopback address
+        return None
 
     def signal_handler(self, signal, frame):
         """Signal handler to close the connection to the hub.\n
@@ -69,29 +136,50 @@ class Connector():
             signal (signal): The signal.\n
             frame (frame): The frame.
         """
-        self.sock.close()
+        if self.sock is not None:
+            self.sock.close()
+        self.close_listener()
         self.logger.display("Disconnected!", "warn")
         sys.exit(0)
 
-    def direct_connect(self, user, cc_port):
-        """Create a socket and listen for connections.\n
+    def listen(self, cc_port, address=''):
+        """Start the shared listener for client to client connections,
+        if it is not running yet. All users connect to this port.\n
+        Args:
+            cc_port (int): The port that connecting users will use.
+            address (string): Local address to listen on, default all.
+        """
+        if self.listener is None:
+            self.listener = Listener(self.logger, cc_port, address)
+
+    def close_listener(self):
+        """Stop the shared listener.
+        """
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+    def expect(self, user):
+        """Announce that user will connect. Call before sending the
+        $ConnectToMe, so that a fast user is not dropped.\n
+        Args:
+            user (string): Username.
+        """
+        self.listener.expect(user)
+
+    def direct_connect(self, user, timeout=None):
+        """Wait for the connection of an expected user.\n
         As the name suggests, this function is essential to the protocol.\n
         Args:
-            user (string): Username (unused).
-            cc_port (stirng): The port that connecting user will use.\n
+            user (string): Username.
+            timeout (float): Seconds to wait, default CONNECT_TIMEOUT.\n
         Returns:
             clink (socket): The socket for client to client connection.
         """
-        cc_sock = socket.socket(socket.AF_INET,
-                                socket.SOCK_STREAM)
-        cc_sock.setsockopt(socket.SOL_SOCKET,
-                           socket.SO_REUSEADDR, 1)
-        cc_sock.settimeout(1)
-        cc_sock.bind(('', cc_port))
-        cc_sock.listen(1)
-        conn, addr = cc_sock.accept()
-        self.sockets[user] = [conn, addr]
+        if timeout is None:
+            timeout = settings.CONNECT_TIMEOUT
+        conn, addr, reader = self.listener.wait(user, timeout)
+        self.sockets[user] = [conn, addr, reader]
         self.logger.display("New connection with '{host}/{port}'".
                             format(host=addr[0], port=addr[1]), "ok")
-        clink = self.sockets[user][0]
-        return clink
+        return conn
@@ -0,0 +1,206 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'crawler.py' fetches the file lists of several users at once.
+
+import time
+import socket
+import threading
+import settings
+
+from utils.scheduler import Scheduler
+
+
+class Crawler():
+
+    def __init__(self, dcbot, sock, ip, cc_port, concurrency,
+                 priority=None):
+        self.dcbot = dcbot
+        self.logger = dcbot.logger
+        self.connection = dcbot.connection
+        self.dc = dcbot.dc
+        self.sock = sock
+        self.ip = ip
+        self.cc_port = cc_port
+        self.concurrency = max(1, concurrency)
+        self.scheduler = Scheduler(priority)
+        self.lock = threading.Lock()
+        self.queued = set()  # users waiting or being fetched
+        self.cancelled = set()  # users that left before their turn
+        self.retries = {}  # user -> failed attempts in this crawl
+        self.aborted = False  # failed users are not retried
+        self.workers = []
+        self.fetched = 0
+        self.fetch_times = []  # seconds from $ConnectToMe to the list
+
+    def crawl(self, userlist):
+        """Fetch the file lists of all users in userlist. Up to
+        'concurrency' users are handled at the same time, each slot
+        keeps its own $ConnectToMe request in flight. All users connect
+        to the shared listener on cc_port. Users are fetched in the
+        order of the priority function, failed users are retried up to
+        MAX_RETRIES times with exponential backoff.\n
+        Args:
+            userlist (list): List of available users.
+        Returns:
+            The number of fetched file lists.
+        """
+        for user in userlist:
+            self.add(user)
+        self.start(min(self.concurrency, len(userlist)))
+        return self.stop()
+
+    def start(self, workers=None):
+        """Start the worker threads, users are added with 'add'.\n
+        Args:
+            workers (int): Number of workers, default concurrency.
+        """
+        if workers is None:
+            workers = self.concurrency
+        for slot in range(workers):
+            worker = threading.Thread(target=self.worker)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def add(self, user):
+        """Queue a user, unless it is already waiting or being fetched.\n
+        Args:
+            user (string): Username.
+        """
+        with self.lock:
+            self.cancelled.discard(user)
+            if user in self.queued:
+                return
+            self.queued.add(user)
+        self.dcbot.checkpoint.record(user, 'pending')
+        self.scheduler.put(user)
+
+    def discard(self, user):
+        """Do not fetch a queued user, e.g. because it left the hub.\n
+        Args:
+            user (string): Username.
+        """
+        with self.lock:
+            if user in self.queued:
+                self.cancelled.add(user)
+
+    def close(self):
+        """No more users will be added, the workers end when the queued
+        users are handled.
+        """
+        self.scheduler.close()
+
+    def abort(self):
+        """Drop the queued users, e.g. when the crawl is interrupted.
+        Users that are being fetched are finished, but not retried.
+        """
+        self.aborted = True
+        for user in self.scheduler.clear():
+            with self.lock:
+                self.queued.discard(user)
+
+    def running(self):
+        """True while a worker is running.
+        """
+        return any(worker.is_alive() for worker in self.workers)
+
+    def stop(self):
+        """Let the workers finish the queued users and stop them.\n
+        Returns:
+            The number of fetched file lists.
+        """
+        self.scheduler.close()
+        # join with a timeout, otherwise SIGINT is not delivered
+        for worker in self.workers:
+            while worker.is_alive():
+                worker.join(1)
+        self.workers = []
+        return self.fetched
+
+    def worker(self):
+        """Take users from the scheduler until 'stop' is called.
+        """
+        while True:
+            user = self.scheduler.get()
+            if user is None:
+                return
+            try:
+                with self.lock:
+                    cancelled = user in self.cancelled
+                    self.cancelled.discard(user)
+                if cancelled or self.fetch(user):
+                    with self.lock:
+                        self.queued.discard(user)
+                    if not cancelled:
+                        self.dcbot.checkpoint.record(user, 'fetched')
+                else:
+                    self.retry(user)
+            finally:
+                # otherwise 'stop' waits for the user forever
+                self.scheduler.done()
+
+    def retry(self, user):
+        """Schedule a failed user again, with exponential backoff.\n
+        Args:
+            user (string): Username.
+        """
+        with self.lock:
+            retries = self.retries.get(user, 0) + 1
+            self.retries[user] = retries
+            if self.aborted:
+                # stays pending in the checkpoint
+                self.queued.discard(user)
+                return
+            if retries > settings.MAX_RETRIES:
+                self.queued.discard(user)
+                self.dcbot.checkpoint.record(user, 'failed')
+                return
+        self.scheduler.put(user, settings.RETRY_DELAY * 2 ** (retries - 1))
+
+    def fetch(self, user):
+        """Connect to a single user and retrieve the file list.\n
+        Args:
+            user (string): Username.
+        Returns:
+            True if the file list was fetched, False else.
+        """
+        metrics = self.dcbot.metrics
+        clink = None
+        start = time.time()
+        fetched = False
+        stage = 'connect'  # reason of a failure
+        metrics.inc('users_attempted_total')
+        try:
+            self.connection.expect(user)
+            self.dc.connect_to_me(self.sock, user, self.ip, self.cc_port)
+            clink = self.connection.direct_connect(user)
+            connected = time.time()
+            metrics.observe('connect_seconds', connected - start)
+            stage = 'handshake'
+            self.dc.handshake_c2c(user, clink)
+            metrics.observe('handshake_seconds', time.time() - connected)
+            stage = 'download'
+            fetched = self.dcbot.get_filelist(user, clink, True)
+            if fetched:
+                with self.lock:
+                    self.fetched += 1
+                    self.fetch_times.append(time.time() - start)
+                metrics.inc('users_fetched_total')
+                metrics.observe('fetch_seconds', time.time() - start)
+        except socket.timeout:
+            stage += '_timeout'
+            self.logger.display("socket timeout: "
+                                "Could not establish "
+                                "connection with user.", "err")
+        except Exception as e:
+            stage = 'error'
+            self.logger.display(str(e), "err")
+        finally:
+            if clink is not None:
+                clink.close()
+            self.connection.sockets.pop(user, None)
+        if not fetched:
+            metrics.inc('users_failed_total', reason=stage)
+            self.dcbot.history.failed(user)
+        return fetched
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
@@ -6,88 +6,149 @@
 
 #   'fileListParser.py' handles parsing for file lists.
 
-import random
-
+from array import array
 from lxml import etree
-from fileTypeParser import FileTypeParser
-from logs import Logger
+from utils.fileTypeParser import FileTypeParser
+from utils.logs import Logger
+
+
+class ParsedFilelist():
+    """Files of a parsed file list, stored by column: one entry per file
+    in names, sizes, path_ids, type_ids and category_ids. Paths, types
+    and categories are kept once and referenced by their index.
+    """
+
+    __slots__ = ('cid', 'names', 'sizes', 'path_ids', 'type_ids',
+                 'category_ids', 'paths', 'types', 'categories', 'index')
+
+    def __init__(self, cid=None):
+        """Args:
+            cid (string): CID of the file list.
+        """
+        self.cid = cid
+        self.names = []
+        self.sizes = array('q')  # bytes, -1 if unknown
+        self.path_ids = array('I')
+        self.type_ids = array('I')
+        self.category_ids = array('I')
+        self.paths = []
+        self.types = []
+        self.categories = []
+        self.index = {'paths': {}, 'types': {}, 'categories': {}}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, column, value):
+        """Get the id of a path, type or category, add it if needed.\n
+        Args:
+            column (string): 'paths', 'types' or 'categories'.
+            value (string): The value.
+        Returns:
+            The index of value in the column.
+        """
+        ids = self.index[column]
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(ids)
+            getattr(self, column).append(value)
+        return value_id
+
+    def add_file(self, name, path_id, size):
+        """Add a file, its type and category are set by 'classify'.\n
+        Args:
+            name (string): Name of the file.
+            path_id (int): Id of the path from 'intern'.
+            size (string): Size attribute of the file.
+        """
+        self.names.append(name)
+        self.path_ids.append(path_id)
+        try:
+            self.sizes.append(int(size))
+        except (TypeError, ValueError):
+            self.sizes.append(-1)
+
+    def classify(self, file_types, file_categories):
+        """Set type and category of all files.\n
+        Args:
+            file_types (list): Type of each file.
+            file_categories (list): Category of each file.
+        """
+        intern = self.intern
+        self.type_ids = array('I', [intern('types', file_type)
+                                    for file_type in file_types])
+        self.category_ids = array('I', [intern('categories', file_category)
+                                        for file_category in file_categories])
 
 
 class FileListParser:
 
     def __init__(self):
         self.logger = Logger(True, False)
-        self.file_types = FileTypeParser().get_file_types()
+        self.type_index = FileTypeParser().get_type_index()
 
     def parseFilelist(self, filelist):
-        """Parses a given file list.\n
+        """Parses a given file list. The list is read as a stream: the
+        path of the current directory is kept on a stack and every file
+        is taken when its element ends, then the element is dropped. So
+        memory does not grow with the size of the list.\n
             Args:
-                filelist (string): File list to parse.
+                filelist (file): File list to parse.
             Returns:
-                user_filelist (array): Including for each file a dict with
-                category, path, size, type, filename.
+                parsed (ParsedFilelist): CID and the files with name,
+                path, type, category and size. None if the list is
+                invalid.
         """
-        user_filelist = []
-        filelist_dic = {}
+        parsed = ParsedFilelist()
+        paths = [parsed.intern('paths', '/')]  # open directories
         try:
-            tree = etree.parse(filelist)
+            for event, elem in etree.iterparse(filelist,
+                                               events=("start", "end")):
+                if event == "start":
+                    if elem.tag == "Directory":
+                        path = parsed.paths[paths[-1]] + \
+                            elem.get("Name", "") + "/"
+                        paths.append(parsed.intern('paths', path))
+                    elif elem.tag == "FileListing":
+                        parsed.cid = elem.get("CID")
+                    continue
+                if elem.tag == "File":
+                    parsed.add_file(elem.get("Name"), paths[-1],
+                                    elem.get("Size"))
+                elif elem.tag == "Directory":
+                    paths.pop()
+                else:
+                    continue
+                # drop the element and the ones before it
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
         except Exception:
             self.logger.display("Invalid filelist found: {}.".format(filelist),
                                 "warn")
-            return []
-
-        root = tree.getroot()
-        cid = root.get("CID")
-
-        unknown_dic = {}
-        for elem in root.iter():
-            file_dic = {}
-            if elem.tag == "File":
-                path = '/'
-                p = elem
-                while True:
-                    # get path of file
-                    try:
-                        p = p.getparent()
-                        path = "/" + p.get("Name") + path
-                    except Exception:
-                        break
-                file_name = elem.get("Name")
-                file_path = path
-                file_type = 'unknown'
-                file_category = 'unknown'
-                try:
-                    file_extension = file_name.rsplit('.', 1)[1]
-                    # check if file extension is known
-                    for extension in self.file_types.values():
-                        if file_extension.lower() in extension:
-                            file_type = file_extension.lower()
-                            # get file category
-                            try:
-                                file_category = \
-                                    [key for key, value in
-                                        self.file_types.iteritems()
-                                        if file_type in value][0]
-                            except Exception:
-                                pass
-
-                            break
-                    if file_type == 'unknown':
-                        if file_extension in unknown_dic:
-                            unknown_dic[file_extension] = \
-                                unknown_dic[file_extension]+1
-                        else:
-                            unknown_dic[file_extension] = 1
-                except Exception:
-                    pass
-
-                file_size = elem.get("Size")
-                file_dic["filename"] = file_name
-                file_dic["path"] = file_path
-                file_dic["type"] = file_type
-                file_dic["category"] = file_category
-                file_dic["size"] = file_size
-                filelist_dic[random.randint(1, 99999)] = file_dic
-        user_filelist.append(cid)
-        user_filelist.append(filelist_dic)
-        return user_filelist
+            return None
+
+        parsed.classify(*self.classify_names(parsed.names))
+        return parsed
+
+    def classify_names(self, file_names):
+        """Get types and categories of many files at once from their
+        extensions.\n
+            Args:
+                file_names (iterable): Names of the files.
+            Returns:
+                (list, list): file types and categories, in the order of
+                file_names, 'unknown' if the extension is not known.
+        """
+        type_index = self.type_index
+        file_types = []
+        file_categories = []
+        for file_name in file_names:
+            file_type = file_name.rsplit('.', 1)[1].lower() \
+                if file_name and '.' in file_name else ''
+            file_category = type_index.get(file_type)
+            if file_category is None:
+                file_type = file_category = 'unknown'
+            file_types.append(file_type)
+            file_categories.append(file_category)
+        return file_types, file_categories
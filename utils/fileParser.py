@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
@@ -6,7 +6,9 @@
 
 #   'fileParser.py' handles parsing for various files.
 
-from logs import Logger
+import settings
+
+from utils.logs import Logger
 
 
 class FileParser:
@@ -46,15 +48,13 @@ class FileParser:
             with users, uid, md5sum and elapsed_time.
         """
         umap = []
-        with open(umap_file) as umap_file:
+        # nicks the hub sent in another encoding get replacement chars
+        with open(umap_file, encoding=settings.HUB_ENCODING,
+                  errors='replace') as umap_file:
             for line in umap_file:
                 values = line.split('|')
                 if len(values) == 4:
-                    try:
-                        username = values[0].encode('utf-8', 'ignore')
-                    except Exception:
-                        username = 'not_printable'
-                    userlist = {'user': username, 'uid': values[1],
+                    userlist = {'user': values[0], 'uid': values[1],
                                 'md5sum': values[2], 'elapsed_time': values[3]}
                     umap.append(userlist)
                 else:
@@ -78,7 +78,7 @@ class FileParser:
                 values = line.split(':')
                 if len(values) == 2:
                     try:
-                        address = values[0].encode('utf-8', 'ignore')
+                        address = values[0]
                         port = values[1]
                         hub = {'address': address, 'port': port}
                         hubs.append(hub)
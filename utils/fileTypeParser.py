@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
@@ -6,10 +6,18 @@
 
 #   'fileTypeParser.py' handles parsing for file types and file categories.
 
+import os
+import pickle
+import hashlib
 import settings
 
+from types import MappingProxyType
 from lxml import etree
-from collections import defaultdict
+
+CACHE_VERSION = 1  # raise when the layout of the cache changes
+
+# compiled table of this process, shared by all parsers
+compiled = None
 
 
 class FileTypeParser:
@@ -17,23 +25,15 @@ class FileTypeParser:
     def __init__(self):
         pass
 
-    def get_file_types(self):
-        """Parsed all known file types from the static FILETYPES file.
-        The location of the FILETYPES file is written in the settings.py.\n
+    def get_type_index(self):
+        """Get the category of every known file type, for lookups in
+        constant time. A file type listed in several categories belongs
+        to the first one.\n
             Returns:
-                file_types (dict): Key: Category, Values: list of file types.
+                type_index (mapping): Key: lowercase file type,
+                Value: category. The mapping is read only.
         """
-        file_types = defaultdict(list)
-        tree = etree.parse(settings.FILETYPES)
-        root = tree.getroot()
-
-        for elem in root.iter():
-            if elem.tag == "FileExtension":
-                file_type = elem.getparent().get("Name")
-                file_extension = (elem.get("Name").lower())
-                file_types[file_type].append(file_extension)
-
-        return file_types
+        return MappingProxyType(self.load()['index'])
 
     def get_file_categories(self):
         """Get all known file categories.
@@ -41,12 +41,67 @@ class FileTypeParser:
             Returns:
                 file_categories (array): All file categories.
         """
+        return list(self.load()['categories'])
+
+    def compile(self):
+        """Parse the FILETYPES file into the type index and the list of
+        categories.\n
+            Returns:
+                table (dict): index (file type -> category) and categories.
+        """
+        type_index = {}
         file_categories = []
         tree = etree.parse(settings.FILETYPES)
-        root = tree.getroot()
+        for elem in tree.getroot().iter("FileType"):
+            category = elem.get("Name")
+            file_categories.append(category)
+            for extension in elem.iter("FileExtension"):
+                type_index.setdefault(extension.get("Name").lower(), category)
+        return {'index': type_index, 'categories': file_categories}
 
-        for elem in root.iter():
-            if elem.tag == "FileType":
-                file_categories.append(elem.get("Name"))
+    def load(self):
+        """Get the compiled FILETYPES file. It is compiled once and kept
+        in FILETYPES_CACHE for all processes. The cache is used while the
+        modification time of FILETYPES is unchanged, or its md5 hash if
+        the time changed.\n
+            Returns:
+                table (dict): index (file type -> category) and categories.
+        """
+        global compiled
+        stat = os.stat(settings.FILETYPES)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if compiled is not None and compiled['stamp'] == stamp:
+            return compiled
+        cache = None
+        try:
+            with open(settings.FILETYPES_CACHE, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+            if cache.get('version') != CACHE_VERSION:
+                cache = None
+        except Exception:
+            cache = None  # missing or unreadable, compile again
+        if cache is None or cache['stamp'] != stamp:
+            with open(settings.FILETYPES, 'rb') as xml_file:
+                md5sum = hashlib.md5(xml_file.read()).hexdigest()
+            if cache is None or cache['md5sum'] != md5sum:
+                cache = self.compile()
+                cache['version'] = CACHE_VERSION
+                cache['md5sum'] = md5sum
+            cache['stamp'] = stamp
+            self.save(cache)
+        compiled = cache
+        return compiled
 
-        return file_categories
+    def save(self, cache):
+        """Write the compiled table to FILETYPES_CACHE. It replaces the
+        file at once, so other processes never read a partial cache.
+        """
+        if not settings.FILETYPES_CACHE:
+            return
+        path = "{}.{}".format(settings.FILETYPES_CACHE, os.getpid())
+        try:
+            with open(path, 'wb') as cache_file:
+                pickle.dump(cache, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(path, settings.FILETYPES_CACHE)
+        except (IOError, OSError):
+            pass  # read only data folder, compiled again next time
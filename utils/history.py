@@ -0,0 +1,121 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'history.py' remembers what was fetched from each user of a hub.
+
+import os
+import threading
+import settings
+
+
+class CrawlHistory():
+
+    def __init__(self, host, port, shard=(0, 1)):
+        """Load the history of a hub. It is kept in one file per hub
+        (and shard) in HISTORY_FOLDER, with one line per user:
+        (nickname|share|cid|attempts|successes|failures|rate).\n
+        Args:
+            host (string): Hub (Server) domain name or ip address.
+            port (int): Hub (Server) port number.
+            shard (tuple): Shard K of N crawled by this process.
+        """
+        name = "{}_{}".format(host, port)
+        if shard[1] > 1:
+            # shards run in parallel and must not overwrite each other
+            name += "_{}-{}".format(*shard)
+        self.path = os.path.join(settings.HISTORY_FOLDER, name)
+        self.lock = threading.Lock()
+        self.users = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, encoding=settings.HUB_ENCODING,
+                  errors='surrogateescape') as history_file:
+            for line in history_file:
+                values = line.rstrip("\n").split("|")
+                if len(values) == 7:
+                    try:
+                        self.users[values[0]] = {
+                            'share': values[1], 'cid': values[2],
+                            'attempts': int(values[3]),
+                            'successes': int(values[4]),
+                            'failures': int(values[5]),
+                            'rate': float(values[6])}
+                    except ValueError:
+                        pass
+
+    def entry(self, user):
+        """Get the history entry of a user.\n
+        Args:
+            user (string): Username.
+        Returns:
+            entry (dict): share, cid, attempts, successes, failures
+            (in a row) and rate (bytes/s), None for unknown users.
+        """
+        return self.users.get(user)
+
+    def new_entry(self, user):
+        """Get the history entry of a user, create it if the user is
+        unknown. Requires the lock.
+        """
+        if user not in self.users:
+            self.users[user] = {'share': "", 'cid': "", 'attempts': 0,
+                                'successes': 0, 'failures': 0, 'rate': 0.0}
+        return self.users[user]
+
+    def unchanged(self, user, share):
+        """Check if the list of a user was fetched before and the
+        user still announces the same share size.\n
+        Args:
+            user (string): Username.
+            share (string): Share size from the user's $MyINFO.
+        Returns:
+            Boolean: True if the list does not need to be fetched again.
+        """
+        entry = self.users.get(user)
+        if entry is None or share is None:
+            return False
+        return entry['share'] == share and entry['cid'] != ""
+
+    def record(self, user, share, cid, rate):
+        """Remember a fetched file list.\n
+        Args:
+            user (string): Username.
+            share (string): Share size from the user's $MyINFO.
+            cid (string): CID of the user's file list.
+            rate (float): Download rate in bytes/s.
+        """
+        with self.lock:
+            entry = self.new_entry(user)
+            entry['share'] = share or ""
+            entry['cid'] = cid or ""
+            entry['attempts'] += 1
+            entry['successes'] += 1
+            entry['failures'] = 0
+            entry['rate'] = rate
+
+    def failed(self, user):
+        """Remember a failed attempt to fetch a file list.\n
+        Args:
+            user (string): Username.
+        """
+        with self.lock:
+            entry = self.new_entry(user)
+            entry['attempts'] += 1
+            entry['failures'] += 1
+
+    def save(self):
+        """Write the history file of the hub.
+        """
+        if not os.path.exists(settings.HISTORY_FOLDER):
+            os.makedirs(settings.HISTORY_FOLDER)
+        with self.lock:
+            with open(self.path + ".tmp", "w",
+                      encoding=settings.HUB_ENCODING,
+                      errors='surrogateescape') as history_file:
+                for user, entry in self.users.items():
+                    history_file.write("|".join([
+                        user, entry['share'], entry['cid'],
+                        str(entry['attempts']), str(entry['successes']),
+                        str(entry['failures']),
+                        "{:.1f}".format(entry['rate'])]) + "\n")
+            os.rename(self.path + ".tmp", self.path)
@@ -0,0 +1,93 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'ingest.py' inserts parsed file lists, users and hubs into the database.
+
+
+class Ingest():
+
+    def __init__(self, db, logger):
+        """Insert crawl results through a database connection. Used by
+        manage.py for the files in tmp and by the crawl pipeline.\n
+        Args:
+            db (Database): The database connection.
+            logger (Logger): Logger for progress messages.
+        """
+        self.db = db
+        self.logger = logger
+
+    def is_filelist_in_DB(self, md5sum):
+        """Checks if user's file list is already in DB.\n
+        Args:
+            md5sum (string): md5 hash of file list.
+        Returns:
+            Boolean: True if user's file list is already in DB, False else.
+        """
+        if len(self.db.get_user_ID_from_md5(md5sum)) > 0:
+            return True
+        return False
+
+    def insert_files_into_db(self, parsed_filelist, md5sum, filelist_size,
+                             users):
+        """Inserts filelist information into database. Does not start
+        a transaction, so that callers can insert several lists in one.\n
+        Args:
+            parsed_filelist (ParsedFilelist): The parsed file list.
+            md5sum (string): md5 hash of the file list.
+            filelist_size (string): The file size.
+            users (list): Nicknames of the users that sent the list.
+        """
+        CID = parsed_filelist.cid
+        # insert each distinct path only if it is not in db already
+        path_ids = []
+        for path in parsed_filelist.paths:
+            if len(self.db.get_pathID(path)) == 0:
+                self.db.add_path((path,))
+            path_ids.append(self.db.get_pathID(path)[0][0])
+        types = parsed_filelist.types
+        categories = parsed_filelist.categories
+        self.db.add_files(
+            (name, types[type_id], categories[category_id],
+             size if size >= 0 else None, path_ids[path_id])
+            for name, path_id, type_id, category_id, size in zip(
+                parsed_filelist.names, parsed_filelist.path_ids,
+                parsed_filelist.type_ids, parsed_filelist.category_ids,
+                parsed_filelist.sizes))
+
+        # insert users & update filelist size
+        self.insert_users_into_db(md5sum, CID, users)
+        self.db.update_filelist_size(filelist_size, md5sum)
+        self.logger.display("Done.", "debug")
+
+    def insert_users_into_db(self, md5sum, cid, users):
+        """Insert all users that sent a file list, each user only once
+        for the same list.\n
+        Args:
+            md5sum (string): md5 hash of the file list.
+            cid (string): CID of the file list.
+            users (list): Nicknames of the users.
+        """
+        for user in users:
+            if len(self.db.get_user_ID(user, md5sum)) == 0:
+                self.db.add_user(user, md5sum, cid)
+
+    def insert_hub_into_db(self, hub_info):
+        """Insert hub only if it is not in db already.\n
+        Args:
+            hub_info (string): Hub information\n
+            (name|port|percentage of filelists feched|minShare|registration):
+        """
+        if len(self.db.get_hubID(hub_info['name'], hub_info['port'])) == 0:
+            self.db.add_hub(hub_info['name'], hub_info['port'],
+                            hub_info['fetched'], hub_info['min_share'],
+                            hub_info['reg'])
+
+    def insert_filelist_into_db(self, filelist_info):
+        """Insert filelist only if it is not in db already.\n
+        Args:
+            filelist_info (string): Filelist information\n
+            (md5sum|elapsed_time)
+        """
+        if len(self.db.get_filelist_ID(filelist_info['md5sum'])) == 0:
+            self.db.add_filelist(filelist_info['md5sum'],
+                                 filelist_info['elapsed_time'])
@@ -0,0 +1,124 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'listener.py' accepts all client to client connections on a single port.
+
+import time
+import socket
+import threading
+import settings
+
+from utils.stream import FrameReader
+from utils.protocol import decode
+
+
+class Listener():
+
+    def __init__(self, logger, port, address=''):
+        self.logger = logger
+        self.port = port
+        self.pending = {}  # nick -> [event, connection]
+        self.lock = threading.Lock()
+        self.running = True
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((address, port))
+        self.sock.listen(settings.LISTEN_BACKLOG)
+        self.sock.settimeout(1)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.display("Listening for users on port {}.".format(port),
+                            "ok")
+
+    def expect(self, user):
+        """Register a user that was asked to connect. Has to be called
+        before the $ConnectToMe is sent.\n
+        Args:
+            user (string): Username.
+        """
+        with self.lock:
+            self.pending[user] = [threading.Event(), None]
+
+    def wait(self, user, timeout):
+        """Wait until the expected user connected.\n
+        Args:
+            user (string): Username.
+            timeout (float): Seconds to wait for the connection.
+        Returns:
+            (socket, address, FrameReader): The connection, the address
+            of the user and the reader holding the data after $MyNick.
+        Raises:
+            socket.timeout: If the user did not connect in time.
+        """
+        with self.lock:
+            request = self.pending.get(user)
+        if request is None:
+            raise socket.timeout("user '{}' not expected".format(user))
+        request[0].wait(timeout)
+        with self.lock:
+            self.pending.pop(user, None)
+            connection = request[1]
+        if connection is None:
+            raise socket.timeout("user '{}' did not connect".format(user))
+        return connection
+
+    def run(self):
+        """Accept connections until the listener is closed and hand
+        each one to 'identify'.
+        """
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            t = threading.Thread(target=self.identify, args=(conn, addr))
+            t.daemon = True
+            t.start()
+
+    def identify(self, conn, addr):
+        """Read the $MyNick of an incoming connection and route it to
+        the pending request of that user. Unknown users are dropped.\n
+        Args:
+            conn (socket): The incoming connection.
+            addr (tuple): Address of the connecting user.
+        """
+        reader = FrameReader(conn)
+        deadline = time.time() + settings.HANDSHAKE_TIMEOUT
+        try:
+            frame = reader.read(deadline)
+        except socket.error:
+            conn.close()
+            return
+        user = decode(frame[len(b"$MyNick "):]) \
+            if frame.startswith(b"$MyNick ") else None
+        routed = False
+        with self.lock:
+            request = self.pending.get(user)
+            if request is not None and request[1] is None:
+                request[1] = (conn, addr, reader)
+                request[0].set()
+                routed = True
+        if not routed:
+            self.logger.display("Dropping unexpected connection from "
+                                "'{}'.".format(addr[0]), "debug")
+            conn.close()
+
+    def close(self):
+        """Stop accepting connections and close the listening socket.
+        """
+        self.running = False
+        try:
+            # wakes up a pending accept
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        self.thread.join()
+        # users that did not connect yet will not
+        with self.lock:
+            for request in self.pending.values():
+                request[0].set()
@@ -1,12 +1,138 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 #   DCbot metadata crawler for forensic lab at TU Darmstadt.
 #   2017 - Mahdi Enan and Florian Platzer
 
 #   'logs.py' handles display and writting logs into debug file.
 
-from datetime import datetime
+import os
+import json
+import time
+import queue
+import atexit
+import threading
 import settings
 
+from datetime import datetime
+
+PREFIXES = {'sent': "[sent]:\t\t ", 'recv': "[recv]:\t\t ",
+            'mesg': "[mesg]:\t\t ", 'err': "[err ]:\t\t ",
+            'warn': "[warn]:\t\t ", 'ok': "[ok  ]:\t\t ",
+            'debug': "[dbg ]:\t\t ", 'info': "[info]:\t\t "}
+COLORS = {'err': "\033[91m", 'warn': "\033[93m", 'ok': "\033[92m",
+          'debug': "\033[94m"}
+ALWAYS = ('sent', 'recv', 'mesg', None)  # shown without verbose as well
+
+# one writer per process, shared by all loggers
+writer = None
+writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Get the log file writer of this process, start it if needed.
+    A forked process starts its own.
+    """
+    global writer
+    with writer_lock:
+        if writer is None or writer.pid != os.getpid():
+            writer = LogWriter(settings.LOG_FILE, settings.LOG_FORMAT)
+            atexit.register(writer.close)
+        return writer
+
+
+class LogWriter():
+
+    def __init__(self, path, format='text'):
+        """Write log records to a file in a background thread. Records
+        are written in batches and flushed every LOG_FLUSH_INTERVAL
+        seconds, so logging does not wait for the disk.\n
+        Args:
+            path (string): The log file.
+            format (string): 'text' lines or 'json' lines.
+        """
+        self.path = path
+        self.format = format
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, created, type, msg):
+        """Queue a record.\n
+        Args:
+            created (float): Time of the record.
+            type (string): The message type.
+            msg (string): The message.
+        """
+        self.queue.put((created, type, msg))
+
+    def line(self, record):
+        """Format a record as a line of the log file.
+        """
+        created, type, msg = record
+        if self.format == 'json':
+            return json.dumps({'time': created, 'type': type,
+                               'message': msg}) + "\n"
+        stamp = datetime.fromtimestamp(created).strftime('%d.%m.%y %H:%M:%S')
+        return stamp + ": " + PREFIXES.get(type, "") + msg + "\n"
+
+    def run(self):
+        """Write queued records until None is queued. An (Event,) in
+        the queue is set once everything before it is flushed.
+        """
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        log_file = open(self.path, 'a', encoding='utf-8')
+        flushed = time.time()
+        running = True
+        while running:
+            try:
+                records = [self.queue.get(
+                    timeout=settings.LOG_FLUSH_INTERVAL)]
+            except queue.Empty:
+                log_file.flush()
+                flushed = time.time()
+                continue
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            events = []
+            for record in records:
+                if record is None:
+                    running = False
+                elif len(record) == 1:
+                    events.append(record[0])
+                else:
+                    lines.append(self.line(record))
+            log_file.write("".join(lines))
+            if events or time.time() - flushed >= \
+                    settings.LOG_FLUSH_INTERVAL:
+                log_file.flush()
+                flushed = time.time()
+            for event in events:
+                event.set()
+        log_file.close()
+
+    def flush(self):
+        """Wait until all queued records are in the file.
+        """
+        if not self.thread.is_alive():
+            return
+        event = threading.Event()
+        self.queue.put((event,))
+        event.wait()
+
+    def close(self):
+        """Write the remaining records and stop the thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
 
 class Logger:
     debug = False
@@ -24,49 +150,35 @@ class Logger:
             * 'ok' is green.
             * 'debug' is blue.
             * The rest 'sent', 'recv' and 'info' are colorless.
+        Messages that are not shown cost only the type check.
         Args:
             msg (string): The message to display.
             type (string): The message type.
         """
-        msg = str(msg)
-        message = ""
-        if type == 'sent':
-            message = "[sent]:\t\t " + msg
-            print message
-        elif type == 'recv':
-            message = "[recv]:\t\t " + msg
-            print message
-        elif type == 'mesg':
-            message = "[mesg]:\t\t " + msg
-            print message
-        elif type is None:
-            message = msg
-            print msg
-        elif self.verbose:
-            if type == 'err':
-                message = "[err ]:\t\t " + msg
-                print "\033[91m" + message + "\033[0m"
-            elif type == 'warn':
-                message = "[warn]:\t\t " + msg
-                print "\033[93m" + message + "\033[0m"
-            elif type == 'ok':
-                message = "[ok  ]:\t\t " + msg
-                print "\033[92m" + message + "\033[0m"
-            elif type == 'debug':
-                message = "[dbg ]:\t\t " + msg
-                print "\033[94m" + message + "\033[0m"
-            elif type == 'info':
-                message = "[info]:\t\t " + msg
-                print message
+        if type not in ALWAYS and not (self.verbose and type in PREFIXES):
+            return
+        # nicks keep undecodable bytes as surrogates, see protocol.decode
+        msg = str(msg).encode('utf-8', 'backslashreplace').decode('utf-8')
+        message = PREFIXES.get(type, "") + msg
+        color = COLORS.get(type)
+        if color is not None:
+            print(color + message + "\033[0m")
+        else:
+            print(message)
         if self.debug:
-            self.debugLog(message)
+            self.debugLog(msg, type)
 
-    def debugLog(self, msg):
-        """Write debug information to log file.\n
+    def debugLog(self, msg, type=None):
+        """Write debug information to log file (see LOG_FORMAT). The
+        line is written by the background writer.\n
         Args:
             msg (string): The actual message to write.
+            type (string): The message type.
+        """
+        get_writer().write(time.time(), type, msg)
+
+    def flush(self):
+        """Wait until the log file holds all messages of this process.
         """
-        time = datetime.now().strftime('%d.%m.%y %H:%M:%S')
-        debug_file = open(settings.LOG_FILE, 'a')
-        debug_file.write(time + ": " + msg + "\n")
-        debug_file.close()
+        if writer is not None and writer.pid == os.getpid():
+            writer.flush()
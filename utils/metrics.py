@@ -0,0 +1,217 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'metrics.py' counts crawl events and exports them for Prometheus.
+
+import os
+import threading
+import http.server
+
+SECONDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)  # bytes per second
+RATIOS = (1, 2, 4, 6, 8, 10, 15, 20)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'users_attempted_total': ('counter', "Fetch attempts.", None),
+    'users_fetched_total': ('counter', "File lists fetched.", None),
+    'users_failed_total': ('counter', "Failed fetch attempts by reason.",
+                           None),
+    'users_skipped_total': ('counter', "Users with an unchanged share.",
+                            None),
+    'received_bytes_total': ('counter', "Compressed bytes received.", None),
+    'connect_seconds': ('histogram', "From $ConnectToMe to the user's "
+                        "connection.", SECONDS),
+    'handshake_seconds': ('histogram', "Client to client handshake.",
+                          SECONDS),
+    'first_byte_seconds': ('histogram', "From $ADCGET to the first data "
+                           "of the list.", SECONDS),
+    'fetch_seconds': ('histogram', "From $ConnectToMe to the complete "
+                      "list.", SECONDS),
+    'download_bytes_per_second': ('histogram', "Download rate of a list.",
+                                  RATES),
+    'decompression_ratio': ('histogram', "Inflated size of a list by its "
+                            "bz2 size.", RATIOS),
+    'queue_ready': ('gauge', "Users waiting to be fetched.", None),
+    'queue_delayed': ('gauge', "Users waiting for a retry.", None),
+    'fetches_active': ('gauge', "Users being fetched.", None),
+    'pipeline_parse_queue': ('gauge', "Lists waiting for a parser.", None),
+    'pipeline_write_queue': ('gauge', "Lists waiting for the database.",
+                             None),
+}
+
+
+class Metrics():
+
+    def __init__(self, labels=None, prefix="dcbot_"):
+        """Counters, histograms and gauges of a crawl, see METRICS.\n
+        Args:
+            labels (dict): Labels added to every sample, e.g. the hub.
+            prefix (string): Prefix of the exported names.
+        """
+        self.labels = labels or {}
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels) -> value or histogram
+        self.gauges = {}  # name -> function
+        self.server = None
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter.\n
+        Args:
+            name (string): Name of the counter.
+            value (float): Amount to add.
+            labels: Labels of the sample, e.g. reason="timeout".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value):
+        """Add a sample to a histogram.\n
+        Args:
+            name (string): Name of the histogram.
+            value (float): The sample.
+        """
+        buckets = METRICS[name][2]
+        key = (name, ())
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(buckets), 'count': 0,
+                             'sum': 0.0}
+                self.values[key] = histogram
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def gauge(self, name, function):
+        """Register a gauge, its value is read when exported.\n
+        Args:
+            name (string): Name of the gauge.
+            function (function): Returns the current value.
+        """
+        self.gauges[name] = function
+
+    def format_labels(self, labels):
+        """Format labels as {a="x",b="y"}.
+        """
+        labels = sorted(self.labels.items()) + list(labels)
+        if not labels:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(
+            key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, value in labels) + "}"
+
+    def prometheus(self):
+        """Export all metrics in the Prometheus text format.\n
+        Returns:
+            The exposition as string.
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = []
+        described = set()
+        for (name, labels), value in values:
+            full = self.prefix + name
+            kind, text, buckets = METRICS[name]
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP {} {}".format(full, text))
+                lines.append("# TYPE {} {}".format(full, kind))
+            if kind != 'histogram':
+                lines.append("{}{} {}".format(
+                    full, self.format_labels(labels), value))
+                continue
+            for bound, count in zip(buckets, value['buckets']):
+                lines.append("{}_bucket{} {}".format(
+                    full, self.format_labels(labels + (('le', bound),)),
+                    count))
+            lines.append("{}_bucket{} {}".format(
+                full, self.format_labels(labels + (('le', "+Inf"),)),
+                value['count']))
+            lines.append("{}_sum{} {}".format(
+                full, self.format_labels(labels), value['sum']))
+            lines.append("{}_count{} {}".format(
+                full, self.format_labels(labels), value['count']))
+        for name, function in sorted(self.gauges.items()):
+            full = self.prefix + name
+            lines.append("# HELP {} {}".format(full, METRICS[name][1]))
+            lines.append("# TYPE {} gauge".format(full))
+            lines.append("{}{} {}".format(full, self.format_labels(()),
+                                          function()))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Get all metrics as dict, for the JSON summary of a run.\n
+        Returns:
+            summary (dict): Counters by name (and labels), histograms
+            with count, sum, mean and buckets.
+        """
+        summary = {}
+        with self.lock:
+            values = sorted(self.values.items())
+        for (name, labels), value in values:
+            if METRICS[name][0] == 'histogram':
+                value = {'count': value['count'], 'sum': value['sum'],
+                         'mean': value['sum'] / max(value['count'], 1),
+                         'buckets': dict(zip(
+                             [str(bound) for bound in METRICS[name][2]],
+                             value['buckets']))}
+            if labels:
+                summary.setdefault(name, {})[
+                    ",".join("{}={}".format(*label) for label in labels)] \
+                    = value
+            else:
+                summary[name] = value
+        return summary
+
+    def write(self, path):
+        """Write the Prometheus text to a file, e.g. for the textfile
+        collector of the node exporter. The file is replaced at once.\n
+        Args:
+            path (string): The metrics file.
+        """
+        with open(path + ".tmp", "w") as metrics_file:
+            metrics_file.write(self.prometheus())
+        os.rename(path + ".tmp", path)
+
+    def serve(self, port, address="127.0.0.1"):
+        """Serve the metrics over HTTP at /metrics.\n
+        Args:
+            port (int): Port of the endpoint.
+            address (string): Local address, default only this host.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop the HTTP endpoint.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
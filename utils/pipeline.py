@@ -0,0 +1,193 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'pipeline.py' parses file lists and fills the database while crawling.
+
+import io
+import queue
+import threading
+import settings
+
+from utils.backend import Database
+from utils.ingest import Ingest
+from utils.fileListParser import FileListParser
+
+
+class Pipeline():
+
+    def __init__(self, logger, store, workers=None, size=None, batch=None):
+        """Parse fetched file lists in worker threads and insert them
+        into the database, instead of going through umap, servinfo and
+        manage.py. The queues are bounded, so the crawl waits when the
+        parsers or the database fall behind.\n
+        Args:
+            logger (Logger): Logger for progress messages.
+            store (ListStore): Store holding lists that are not passed
+            in memory.
+            workers (int): Parser threads, default PIPELINE_WORKERS.
+            size (int): Length of each queue, default PIPELINE_QUEUE.
+            batch (int): Lists per transaction, default PIPELINE_BATCH.
+        """
+        self.logger = logger
+        self.store = store
+        self.batch = batch or settings.PIPELINE_BATCH
+        self.parse_queue = queue.Queue(size or settings.PIPELINE_QUEUE)
+        self.write_queue = queue.Queue(size or settings.PIPELINE_QUEUE)
+        self.parser = FileListParser()
+        self.lock = threading.Lock()
+        self.claimed = set()  # lists in the database or being parsed
+        self.ready = threading.Event()  # claimed was loaded
+        self.inserted = 0  # lists inserted with their files
+        self.writer = threading.Thread(target=self.write)
+        self.writer.daemon = True
+        self.writer.start()
+        self.parsers = []
+        for i in range(workers or settings.PIPELINE_WORKERS):
+            t = threading.Thread(target=self.parse)
+            t.daemon = True
+            t.start()
+            self.parsers.append(t)
+
+    def put(self, user, md5sum, elapsed_time, size, data=None):
+        """Add a fetched file list, waits while the queue is full. A list
+        that is already in the database or being parsed only adds the
+        user.\n
+        Args:
+            user (string): Nickname of the user that sent the list.
+            md5sum (string): md5 hash of the list.
+            elapsed_time (string): Download time in seconds.
+            size (int): Inflated size of the list.
+            data (bytes): The inflated list, None to read it from the
+            store.
+        """
+        self.ready.wait()
+        item = {'user': user, 'md5sum': md5sum,
+                'elapsed_time': elapsed_time, 'size': size}
+        with self.lock:
+            first = md5sum not in self.claimed
+            self.claimed.add(md5sum)
+        if first:
+            item['data'] = data
+            self.parse_queue.put(item)
+        else:
+            self.write_queue.put(('user', item, None))
+
+    def hub(self, host, port, perc):
+        """Add the hub information of a finished crawl.\n
+        Args:
+            host (string): Hub (Server) domain name or ip address.
+            port (int): Hub (Server) port number.
+            perc (string): Percentage of users whose lists are known.
+        """
+        self.write_queue.put(('hub', {'name': str(host), 'port': str(port),
+                                      'fetched': str(perc),
+                                      'min_share': "false",
+                                      'reg': "false"}, None))
+
+    def parse(self):
+        """Parser thread: parse lists until None is queued.
+        """
+        while True:
+            item = self.parse_queue.get()
+            if item is None:
+                return
+            data = item.pop('data')
+            parsed = None
+            try:
+                if data is not None:
+                    filelist = io.BytesIO(data)
+                else:
+                    filelist = self.store.open(item['md5sum'])
+                try:
+                    parsed = self.parser.parseFilelist(filelist)
+                finally:
+                    filelist.close()
+            except Exception as e:
+                self.logger.display("Could not parse {}: {}".format(
+                                    item['md5sum'], e), "err")
+            self.write_queue.put(('list', item, parsed))
+
+    def write(self):
+        """Database thread: insert queued lists and hubs in batches of
+        up to PIPELINE_BATCH, until None is queued. The sqlite
+        connection belongs to this thread.
+        """
+        try:
+            db = Database()
+            ingest = Ingest(db, self.logger)
+            with self.lock:
+                self.claimed.update(md5sum for (md5sum,) in db.get_md5sums())
+        finally:
+            self.ready.set()
+        waiting = {}  # md5sum -> users whose list is still parsed
+        running = True
+        while running:
+            entries = [self.write_queue.get()]
+            while len(entries) < self.batch:
+                try:
+                    entries.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in entries:
+                running = False
+                entries = [entry for entry in entries if entry is not None]
+            if not entries:
+                continue
+            try:
+                db.begin_transaction()
+                for kind, item, parsed in entries:
+                    if kind == 'hub':
+                        ingest.insert_hub_into_db(item)
+                    else:
+                        self.insert(db, ingest, kind, item, parsed,
+                                    waiting)
+                db.end_transaction()
+            except Exception as e:
+                self.logger.display("Database: " + str(e), "err")
+                try:
+                    db.cursor.execute("rollback")
+                except Exception:
+                    pass
+        db.close_connection()
+
+    def insert(self, db, ingest, kind, item, parsed, waiting):
+        """Insert a list, or only its user if the list was parsed before.
+        Requires a transaction.\n
+        Args:
+            db (Database): The database connection.
+            ingest (Ingest): Ingest on the connection.
+            kind (string): 'list' for a parsed list, 'user' for a list
+            that was parsed before.
+            item (dict): The queued list.
+            parsed (ParsedFilelist): Result of the parser, None if the
+            list is invalid.
+            waiting (dict): Users of lists that are still parsed.
+        """
+        md5sum = item['md5sum']
+        ingest.insert_filelist_into_db(item)
+        if kind == 'user':
+            if ingest.is_filelist_in_DB(md5sum):
+                cid = db.get_cid_from_md5(md5sum)[0][0]
+                ingest.insert_users_into_db(md5sum, cid, [item['user']])
+            else:
+                waiting.setdefault(md5sum, []).append(item['user'])
+            return
+        users = [item['user']] + waiting.pop(md5sum, [])
+        if parsed is None:
+            with self.lock:
+                self.claimed.discard(md5sum)
+            return
+        ingest.insert_files_into_db(parsed, md5sum, item['size'], users)
+        self.inserted += 1
+
+    def close(self):
+        """Wait until all queued lists are in the database.
+        """
+        for t in self.parsers:
+            self.parse_queue.put(None)
+        for t in self.parsers:
+            t.join()
+        self.write_queue.put(None)
+        self.writer.join()
+        self.logger.display("Inserted {} file lists into the database.".
+                            format(self.inserted), "ok")
@@ -4,7 +4,46 @@
 #   'protocol.py' implements the direct connect commands
 
 import sys
+import time
 import socket
+import threading
+import settings
+
+from utils.stream import FrameReader
+from utils.rate import TokenBucket
+
+
+def decode(data):
+    """Decode a nick or hub text received from the wire. Bytes that
+    are invalid in HUB_ENCODING are kept as surrogates, so 'encode'
+    gives back the exact nick the hub knows.\n
+    Args:
+        data (bytes): Part of a command.
+    Returns:
+        The text.
+    """
+    return data.decode(settings.HUB_ENCODING, 'surrogateescape')
+
+
+def encode(text):
+    """Encode a nick or text for the wire, the inverse of 'decode'.\n
+    Args:
+        text (string): The text.
+    Returns:
+        The bytes to send.
+    """
+    return text.encode(settings.HUB_ENCODING, 'surrogateescape')
+
+
+def printable(text):
+    """Replace the undecodable bytes of a decoded nick, for the
+    database and other files that are not read by the crawler.\n
+    Args:
+        text (string): A decoded nick.
+    Returns:
+        The text without surrogates.
+    """
+    return encode(text).decode(settings.HUB_ENCODING, 'replace')
 
 
 class DC():
@@ -15,18 +54,21 @@ class DC():
         self.connector = connector
         self.BUFFER_SIZE = BUFFER_SIZE
         self.nick = args['nick']
-        self.supports = "UserCommand UserIP2 TTHSearch GetZBlock"
+        self.supports = b"UserCommand UserIP2 TTHSearch GetZBlock"
+        self.send_lock = threading.Lock()  # hub socket is shared
+        self.limiter = TokenBucket(args.get('rate') or settings.CTM_RATE)
+        self.redirect = None  # (host, port) of a $ForceMove
+        self.operators = None  # nicks of the $OpList, None before it
 
     def calculate_key(self, lock):
         """Implemented on the basis of information from
         Measurement and Analysis of Direct Connect Peer-to-Peer
         File Sharing Network by Karl Molin.\n
         Args:
-            lock (string): The calculated lock.\n
+            lock (bytes): The lock sent by the hub or user.\n
         Returns:
-            the calculated key.
+            the calculated key as bytes.
         """
-        lock = [ord(c) for c in lock]
         key = [0]
         for i in range(1, len(lock)):
             key.append(lock[i] ^ lock[i - 1])
@@ -36,68 +78,105 @@ class DC():
             key[i] = ((key[i] << 4) & 240 | (key[i] >> 4) & 15)
         # There are some forbidden ASCII schars: 0, 5, 36, 96, 124, 126
         # Substitute it with the string: /%DCN0<0|5|36|96|124|126>%/
-        result = ""
+        result = bytearray()
         for c in key:
             if c in [0, 5, 36, 96, 124, 126]:
-                result += "/%%DCN%.3i%%/" % c
+                result += b"/%%DCN%03d%%/" % c
             else:
-                result += chr(c)
-        return result
+                result.append(c)
+        return bytes(result)
 
     def get_key(self, data, sock):
         """Get servers lock from the whole server answer.\n
         Return:
             The calculated key.
+        Raises:
+            socket.error: If the answer holds no lock. The caller closes
+            sock, the handshake runs in worker threads as well.
 
         """
         x = data.split()
-        key = ""
-        if(x[0] == "$Lock"):
-            key = self.calculate_key(x[1])
-        else:
-            self.logger.display("Failed to aquire lock, exiting!", "err")
-            sock.close()
-            sys.exit(0)
-        return key
+        if len(x) < 2 or x[0] != b"$Lock":
+            raise socket.error("Failed to aquire lock.")
+        return self.calculate_key(x[1])
 
     def handshake_c2s(self, sock):
-        """Handshake between client and hub to establish a connection\n
+        """Handshake between client and hub to establish a connection.
+        Every step ends as soon as the hub's answer is complete.\n
         Args:
             sock (socket): Server connection socket.
 
         """
-        lock = sock.recv(self.BUFFER_SIZE)
-        self.logger.display("Received lock from server.", "recv")
-        key = self.get_key(lock, sock)
-        payload = "$Key " + key + "|" + \
-                  "$ValidateNick {nick}|".format(nick=self.nick)
-        if self.supports is not None:
-                payload = "$Supports {supports} |" \
-                          .format(supports=self.supports) + payload
-        sock.send(payload)
-        self.logger.display("Sending supported functions.", "sent")
-        sock.settimeout(5)
-        recv_hello = sock.recv(self.BUFFER_SIZE)
+        self.hub = FrameReader(sock)
+        self.operators = None
+        deadline = time.time() + settings.HANDSHAKE_TIMEOUT
+        try:
+            lock = self.hub.wait_for((b"$Lock",), deadline)
+            self.logger.display("Received lock from server.", "recv")
+            key = self.get_key(lock, sock)
+            payload = b"$Key " + key + b"|" + \
+                      b"$ValidateNick " + encode(self.nick) + b"|"
+            if self.supports is not None:
+                    payload = b"$Supports " + self.supports + b" |" + payload
+            sock.sendall(payload)
+            self.logger.display("Sending supported functions.", "sent")
+            hello = self.hub.wait_for((b"$Hello " + encode(self.nick),
+                                       b"$ForceMove "), deadline,
+                                      self.handle_response_restrictions)
+        except socket.timeout:
+            self.logger.display("Hub did not answer the handshake, "
+                                "exiting!", "err")
+            sock.close()
+            sys.exit(0)
+        except socket.error as e:
+            self.logger.display(str(e) + " Exiting!", "err")
+            sock.close()
+            sys.exit(0)
+        if hello.startswith(b"$ForceMove "):
+            # the bot reconnects once this hub is left
+            self.handle_response_restrictions(hello)
+            if self.redirect is None:
+                self.logger.display("Hub redirects to an invalid address, "
+                                    "exiting!", "err")
+                sock.close()
+                sys.exit(0)
+            return
         self.logger.display("Received hello message from server.", "mesg")
-        self.handle_response_restrictions(recv_hello)
 
         self.send_infos(sock)
-        recv_shake = sock.recv(self.BUFFER_SIZE)
-        self.handle_response_restrictions(recv_shake)
         self.logger.display("Success in performing handshake with server.", "mesg")
-        self.handle_response_restrictions(recv_shake)
 
     def handle_response_restrictions(self, message):
         """Handle restrictions displayed in the hello response message
-        uses blacklisting because now standard was specified.\n
+        uses blacklisting because now standard was specified.
+        Only messages of the hub count, see from_hub. A $ForceMove only
+        records the new hub in redirect.\n
         Args:
-            message (string): The message to be checked.
+            message (bytes): The message to be checked.
         """
-        if "$ForceMove" in message:
-            redirect = message.split("$")[1].split(" ")[1].split("|")[0]
-            host, port = redirect.split(":")
-            self.logger.display("Redirecting to: " + host + ".", "warn")
-            self.dcbot.reconnect(host, port)
+        message = decode(message)
+        if message.startswith("$OpList "):
+            if self.operators is None:
+                self.operators = set()
+            self.operators.update(message.partition(" ")[2].split("$$"))
+            return
+        if message.startswith("$ForceMove "):
+            self.limiter.back_off()
+            # the crawl of this hub is ended first, see DCbot.reconnect
+            self.redirect = self.parse_redirect(message.partition(" ")[2])
+            if self.redirect is not None:
+                self.logger.display("Redirecting to: " + self.redirect[0] +
+                                    ".", "warn")
+            return
+        # warnings come as chat or private message, not in $MyINFO
+        if not self.from_hub(message):
+            return
+        lowered = message.lower()
+        if any(warning in lowered for warning in settings.HUB_WARNINGS):
+            self.limiter.back_off()
+            self.logger.display("Hub complains, reducing request rate to "
+                                "{:.2f}/s.".format(self.limiter.rate),
+                                "warn")
         if "Max unlimited share" in message:
             self.logger.display("This server requires registered users!",
                                 "warn")
@@ -120,24 +199,63 @@ class DC():
             self.logger.display("exiting", "warn")
             exit(0)
 
+    def from_hub(self, message):
+        """Check whether a message is chat of the hub itself, of an
+        operator from the $OpList or a private message to this bot.
+        Until the $OpList arrived all chat counts, users only talk to
+        logged in clients.\n
+        Args:
+            message (string): The decoded message.
+        Returns:
+            True if the hub is speaking, False for users and commands.
+        """
+        if message.startswith("$To: "):
+            return message.split(" ")[1] == self.nick
+        if message.startswith("$"):
+            return False
+        if message.startswith("<"):
+            sender = message[1:].partition(">")[0]
+            return self.operators is None or sender in self.operators
+        return True
+
+    def parse_redirect(self, target):
+        """Parse the target of a $ForceMove, e.g. 'dchub://host:411'.\n
+        Args:
+            target (string): Address of the new hub.
+        Returns:
+            (host, port) of the new hub, the port is 411 if it is missing
+            or invalid. None if there is no host or it is no NMDC hub.
+        """
+        target = target.strip()
+        if target.lower().startswith("dchub://"):
+            target = target[len("dchub://"):]
+        if "://" in target:
+            return None
+        host, _, port = target.rstrip("/").partition(":")
+        if not host or "/" in host or " " in host:
+            return None
+        return host, int(port) if port.isdigit() else 411
+
     def handshake_c2c(self, user, clink):
         """Handshake between client and client to establish a P2P connection.\n
         Args:
             user (string): Username.
             clink (socket): Socket for user to user connection.
         """
-        re = self.connector.sockets[user][0].recv(self.BUFFER_SIZE)
-        lock = re.split('|')[1] + '|'
-        shakestart = "$MyNick {}|"\
-                     "$Lock EXTENDEDPROTOCOLABCABCABCABCABCABC "\
-                     "Pk=DCPLUSPLUS0.865ABCABC|".format(self.nick)
-        supports = "$Supports MiniSlots XmlBZList ADCGet TTHL TTHF ZLIG|"
-        direction = "$Direction Download 32766|"
-        key = "$Key " + self.get_key(lock, clink) + "|"
-
-        clink.send(shakestart + supports + direction + key)
-
-        clink.recv(self.BUFFER_SIZE)
+        # $MyNick was consumed by the listener, $Lock follows
+        reader = self.connector.sockets[user][2]
+        deadline = time.time() + settings.HANDSHAKE_TIMEOUT
+        lock = reader.wait_for((b"$Lock",), deadline)
+        shakestart = b"$MyNick " + encode(self.nick) + b"|" \
+                     b"$Lock EXTENDEDPROTOCOLABCABCABCABCABCABC " \
+                     b"Pk=DCPLUSPLUS0.865ABCABC|"
+        supports = b"$Supports MiniSlots XmlBZList ADCGet TTHL TTHF ZLIG|"
+        direction = b"$Direction Download 32766|"
+        key = b"$Key " + self.get_key(lock, clink) + b"|"
+
+        clink.sendall(shakestart + supports + direction + key)
+
+        reader.wait_for((b"$Key",), deadline)
         self.logger.display("Received handshake response.", "recv")
 
     def send_infos(self, sock):
@@ -145,18 +263,26 @@ class DC():
         Args:
             sock (socket): User to Server socket connection.
         """
-        msg = "$Version 1.0091|" + \
-              "$MyINFO $ALL {nick} ".format(nick=self.nick) + \
-              "<pyDC V:1,M:A,H:0/1/0,S:2>$ " + \
-              "$100{flag}$".format(flag=chr(1)) + \
-              "${size}".format(size=1073741824) + \
-              "$|$GetNickList|"
+        msg = b"$Version 1.0091|" + \
+              b"$MyINFO $ALL " + encode(self.nick) + b" " + \
+              b"<pyDC V:1,M:A,H:0/1/0,S:2>$ " + \
+              b"$100\x01$" + \
+              b"$" + str(1073741824).encode('ascii') + \
+              b"$|$GetNickList|"
         try:
             sock.send(msg)
         except socket.error as e:
-            print e
+            print(e)
         self.logger.display("Sending bot information.", "sent")
 
+    def keep_alive(self, sock):
+        """Send an empty command, so that the hub keeps the connection.\n
+        Args:
+            sock (socket): Server connection socket.
+        """
+        with self.send_lock:
+            sock.sendall(b"|")
+
     def connect_to_me(self, sock, user, ip, cc_port):
         """ Send the ConnectToMe command to as user to connection to created socket.\n
         Args:
@@ -165,7 +291,60 @@ class DC():
             ip (string): crawler ip
             cc_port: (socket): crawlers c2c socket.
         """
-        payload = "$ConnectToMe {} "\
-            "{}:{}|".format(user, ip, cc_port)
+        payload = b"$ConnectToMe " + encode(user) + \
+            " {}:{}|".format(ip, cc_port).encode('ascii')
+        self.limiter.acquire()
         self.logger.display("Sending connection request to {}.".format(user), "sent")
-        sock.send(payload)
+        with self.send_lock:
+            sock.sendall(payload)
+
+    def parse_myinfo(self, command):
+        """Parse the $MyINFO command of a user.\n
+        Args:
+            command (bytes): The command without '|'.
+        Returns:
+            info (dict): nick, share (announced bytes as string) and mode
+            ('A' active, 'P' passive, '' unknown), None if it is no
+            valid $MyINFO.
+        """
+        if not command.startswith(b"$MyINFO $ALL "):
+            return None
+        nick, _, info = command[len(b"$MyINFO $ALL "):].partition(b" ")
+        # description<tag>$ $connection<flag>$email$share$
+        fields = info.split(b"$")
+        if nick == b"" or len(fields) < 5:
+            return None
+        mode = ""
+        tag = fields[0][fields[0].rfind(b"<") + 1:].rstrip(b">")
+        for part in tag.split(b","):
+            if part.startswith(b"M:"):
+                mode = decode(part[2:])
+        return {'nick': decode(nick), 'share': decode(fields[4]),
+                'mode': mode}
+
+    def adc_get(self, reader, filename="files.xml.bz2"):
+        """Request a file with $ADCGET (ZL1 compressed) and read the
+        $ADCSND answer of the user.\n
+        Args:
+            reader (FrameReader): Reader of the user to user connection.
+            filename (string): The requested file.
+        Returns:
+            (int, bytes): The announced file size and the data received
+            after the $ADCSND command.
+        Raises:
+            socket.error: If the user refuses to send the file.
+        """
+        getlist = "$ADCGET file {} 0 -1 ZL1|".format(filename)
+        reader.sock.sendall(encode(getlist))
+        self.logger.display(getlist, "sent")
+        deadline = time.time() + settings.HANDSHAKE_TIMEOUT
+        command = reader.wait_for((b"$ADCSND", b"$Error", b"$MaxedOut"),
+                                  deadline)
+        if not command.startswith(b"$ADCSND"):
+            raise socket.error(decode(command))
+        self.logger.display(decode(command), "recv")
+        try:
+            size = int(command.split(b" ")[4])
+        except (IndexError, ValueError):
+            size = None
+        return size, reader.take()
@@ -0,0 +1,117 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'rate.py' measures transfer rates and limits command rates.
+
+import time
+import settings
+import threading
+
+
+class RateMeter():
+
+    def __init__(self, alpha=None):
+        """Estimate the rate of a single download with an exponentially
+        weighted moving average over the received chunks.\n
+        Args:
+            alpha (float): Weight of the newest sample, default RATE_ALPHA.
+        """
+        self.alpha = alpha or settings.RATE_ALPHA
+        self.rate = None  # bytes per second
+        self.total = 0  # bytes
+        self.start = time.time()
+        self.last = self.start
+        self.shown = self.start
+
+    def update(self, size):
+        """Add a received chunk.\n
+        Args:
+            size (int): Number of received bytes.
+        """
+        now = time.time()
+        sample = size / max(now - self.last, 0.000001)
+        self.last = now
+        self.total += size
+        if self.rate is None:
+            self.rate = sample
+        else:
+            self.rate = self.alpha * sample + (1 - self.alpha) * self.rate
+
+    def timeout(self, size):
+        """Time to wait for the next chunk of the connection. It is
+        TIMEOUT_FACTOR times the time the chunk takes at the measured
+        rate, between MIN_CLIENT_TIMEOUT and CLIENT_TIMEOUT.\n
+        Args:
+            size (int): Size of the next chunk.
+        Returns:
+            The timeout in seconds.
+        """
+        if not self.rate:
+            return settings.CLIENT_TIMEOUT
+        timeout = settings.TIMEOUT_FACTOR * size / self.rate
+        return min(max(timeout, settings.MIN_CLIENT_TIMEOUT),
+                   settings.CLIENT_TIMEOUT)
+
+    def due(self, interval=0.5):
+        """True once every interval seconds, to throttle output.
+        """
+        now = time.time()
+        if now - self.shown < interval:
+            return False
+        self.shown = now
+        return True
+
+    def format(self):
+        """The current rate in B/s, KB/s or MB/s.
+        """
+        speed, unit = self.rate or 0.0, "B"
+        for next_unit in ("KB", "MB"):
+            if speed < 1024:
+                break
+            speed, unit = speed / 1024, next_unit
+        return "{:.2f} {}/s".format(speed, unit)
+
+
+class TokenBucket():
+
+    def __init__(self, rate, burst=None):
+        """Limit the rate of hub commands. The rate is halved when the
+        hub complains and slowly raised again while it stays quiet.\n
+        Args:
+            rate (float): Initial commands per second.
+            burst (int): Commands that may be sent at once.
+        """
+        self.rate = rate
+        self.burst = burst or settings.CTM_BURST
+        self.tokens = float(self.burst)
+        self.last = time.time()
+        self.changed = self.last  # last change of the rate
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a command may be sent.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.last) * self.rate)
+                self.last = now
+                if now - self.changed >= settings.CTM_QUIET:
+                    self.rate = min(self.rate + settings.CTM_INCREASE,
+                                    settings.CTM_MAX_RATE)
+                    self.changed = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def back_off(self):
+        """Reduce the rate after a warning, kick or redirect of the hub.
+        """
+        with self.lock:
+            self.rate = max(self.rate * settings.CTM_BACKOFF,
+                            settings.CTM_MIN_RATE)
+            self.tokens = 0.0
+            self.changed = time.time()
@@ -0,0 +1,125 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'scheduler.py' decides which user is fetched next.
+
+import math
+import time
+import heapq
+import itertools
+import threading
+
+
+def share_priority(info, entry):
+    """Default priority of a user: large shares of active users that
+    answered fast in earlier crawls come first, users that keep failing
+    come last.\n
+    Args:
+        info (dict): Parsed $MyINFO of the user or None.
+        entry (dict): History entry of the user or None.
+    Returns:
+        The priority, higher is fetched earlier.
+    """
+    priority = 0.0
+    if info is not None:
+        try:
+            priority += math.log(int(info['share']) + 1, 2)
+        except ValueError:
+            pass
+        if info['mode'] == 'A':
+            priority += 2
+    if entry is not None:
+        # smoothed success rate of earlier attempts
+        priority *= (entry['successes'] + 1.0) / (entry['attempts'] + 2.0)
+        priority += math.log(entry['rate'] + 1, 2) / 4
+    return priority
+
+
+class Scheduler():
+
+    def __init__(self, priority=None):
+        """Queue of users waiting to be fetched, ordered by priority.
+        Without a priority function users are fetched in the order
+        they were added.\n
+        Args:
+            priority (function): Maps a user to a number, higher values
+            are fetched first.
+        """
+        self.priority = priority
+        self.ready = []  # (-priority, sequence, user)
+        self.delayed = []  # (not before, sequence, user)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.active = 0  # users handed out and not done yet
+        self.closed = False
+
+    def put(self, user, delay=0):
+        """Add a user.\n
+        Args:
+            user (string): Username.
+            delay (float): Seconds before the user may be fetched.
+        """
+        with self.condition:
+            if delay > 0:
+                heapq.heappush(self.delayed, (time.time() + delay,
+                                              next(self.sequence), user))
+            else:
+                self.push(user)
+            self.condition.notify()
+
+    def push(self, user):
+        """Add a user that can be fetched now. Requires the lock.
+        """
+        priority = 0 if self.priority is None else self.priority(user)
+        heapq.heappush(self.ready, (-priority, next(self.sequence), user))
+
+    def get(self):
+        """Wait for the next user. 'done' has to be called when the
+        user is handled.\n
+        Returns:
+            The user with the highest priority, None once the scheduler
+            is closed and no user is left.
+        """
+        with self.condition:
+            while True:
+                now = time.time()
+                while self.delayed and self.delayed[0][0] <= now:
+                    self.push(heapq.heappop(self.delayed)[2])
+                if self.ready:
+                    self.active += 1
+                    return heapq.heappop(self.ready)[2]
+                if self.closed and not self.delayed and self.active == 0:
+                    return None
+                timeout = None
+                if self.delayed:
+                    timeout = self.delayed[0][0] - now
+                self.condition.wait(timeout)
+
+    def done(self):
+        """Mark a user from 'get' as handled.
+        """
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def close(self):
+        """Accept no new users from outside; 'get' returns None when the
+        remaining and retried users are handled.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def clear(self):
+        """Drop all waiting users and close the scheduler, users that
+        are handed out are still finished.\n
+        Returns:
+            The dropped users.
+        """
+        with self.condition:
+            dropped = [entry[2] for entry in self.ready + self.delayed]
+            self.ready = []
+            self.delayed = []
+            self.closed = True
+            self.condition.notify_all()
+            return dropped
@@ -0,0 +1,270 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'simulator.py' simulates a NMDC hub and its users on the local host.
+
+import bz2
+import time
+import zlib
+import socket
+import random
+import threading
+
+
+def read_command(sock, buf):
+    """Read the next '|' terminated command.\n
+    Args:
+        sock (socket): Connection to read from.
+        buf (list): Pending bytes of the connection, updated in place.
+    Returns:
+        The decoded command without '|', None if the connection was
+        closed.
+    """
+    while b"|" not in buf[0]:
+        try:
+            data = sock.recv(4096)
+        except socket.error:
+            return None
+        if not data:
+            return None
+        buf[0] += data
+    command, buf[0] = buf[0].split(b"|", 1)
+    return command.decode('utf-8', 'surrogateescape')
+
+
+def send(sock, commands):
+    """Send commands.\n
+    Args:
+        sock (socket): Connection to send to.
+        commands (string): The '|' terminated commands.
+    """
+    sock.sendall(commands.encode('utf-8', 'surrogateescape'))
+
+
+class SimPeer():
+
+    def __init__(self, nick, files, latency, bandwidth):
+        """A simulated user sharing a generated file list.\n
+        Args:
+            nick (string): Nickname of the user.
+            files (int): Number of files in the file list.
+            latency (float): Delay in seconds before every answer.
+            bandwidth (int): Upload rate in bytes/s, 0 is unlimited.
+        """
+        self.nick = nick
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.filelist = self.create_filelist(files)
+        self.share = files * 1024 * 1024
+
+    def create_filelist(self, files):
+        """Create a ZL1 compressed files.xml.bz2.\n
+        Args:
+            files (int): Number of files in the list.
+        Returns:
+            (int, bytes): Size of the bz2 list and the zlib data.
+        """
+        lines = ['<?xml version="1.0" encoding="utf-8" standalone="yes"?>',
+                 '<FileListing Version="1" CID="{:032X}" Base="/" '
+                 'Generator="pyDC simulator">'.format(
+                     random.getrandbits(128))]
+        for i in range(files):
+            if i % 100 == 0:
+                if i > 0:
+                    lines.append('</Directory>')
+                lines.append('<Directory Name="Folder {}">'.format(i // 100))
+            lines.append('<File Name="file {} of {}.{}" Size="{}" '
+                         'TTH="{:039X}"/>'.format(
+                             i, self.nick,
+                             random.choice(["mp3", "avi", "pdf", "txt"]),
+                             random.randint(1, 1 << 30),
+                             random.getrandbits(155)))
+        if files > 0:
+            lines.append('</Directory>')
+        lines.append('</FileListing>')
+        xml_bz2 = bz2.compress("\n".join(lines).encode('utf-8', 'replace'))
+        return len(xml_bz2), zlib.compress(xml_bz2)
+
+    def myinfo(self):
+        """The $MyINFO of the user.
+        """
+        return "$MyINFO $ALL {} <pyDC V:1,M:A,H:1/0/0,S:3>$ $100{}$${}$"\
+            .format(self.nick, chr(1), self.share)
+
+    def connect(self, ip, port):
+        """Answer a $ConnectToMe: connect and upload the file list.\n
+        Args:
+            ip (string): Address of the requesting client.
+            port (int): Port of the requesting client.
+        """
+        time.sleep(self.latency)
+        try:
+            conn = socket.create_connection((ip, port), 10)
+        except socket.error:
+            return
+        buf = [b""]
+        try:
+            send(conn, "$MyNick {}|$Lock EXTENDEDPROTOCOLSIM "
+                       "Pk=pyDCsim|".format(self.nick))
+            while True:
+                command = read_command(conn, buf)
+                if command is None:
+                    return
+                if command.startswith("$Key"):
+                    break
+            time.sleep(self.latency)
+            send(conn, "$Supports ADCGet XmlBZList ZLIG|"
+                       "$Direction Upload 1|$Key simulated|")
+            while True:
+                command = read_command(conn, buf)
+                if command is None:
+                    return
+                if command.startswith("$ADCGET"):
+                    break
+            time.sleep(self.latency)
+            size, data = self.filelist
+            send(conn, "$ADCSND file files.xml.bz2 0 {} ZL1|".format(size))
+            self.upload(conn, data)
+            # wait until the client hangs up
+            read_command(conn, buf)
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def upload(self, conn, data):
+        """Send data, limited to the bandwidth of the user.\n
+        Args:
+            conn (socket): Connection to the client.
+            data (bytes): Data to send.
+        """
+        if not self.bandwidth:
+            conn.sendall(data)
+            return
+        chunk = max(1, self.bandwidth // 10)
+        for i in range(0, len(data), chunk):
+            conn.sendall(data[i:i + chunk])
+            time.sleep(0.1)
+
+
+class SimHub():
+
+    def __init__(self, port, users=100, files=1000, latency=0.0,
+                 bandwidth=0):
+        """A simulated hub with its users, listening on the local host.\n
+        Args:
+            port (int): Port of the hub.
+            users (int): Number of simulated users.
+            files (int): Number of files in each file list.
+            latency (float): Delay in seconds before every answer.
+            bandwidth (int): Upload rate of each user in bytes/s.
+        """
+        self.latency = latency
+        self.files = files
+        self.bandwidth = bandwidth
+        self.clients = []
+        self.peers = {}
+        for i in range(users):
+            peer = SimPeer("user{:05d}".format(i), files, latency, bandwidth)
+            self.peers[peer.nick] = peer
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen(16)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def list_size(self):
+        """Total size of all compressed file lists in bytes.
+        """
+        return sum(len(peer.filelist[1]) for peer in self.peers.values())
+
+    def run(self):
+        """Accept clients until the hub is closed.
+        """
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                break
+            t = threading.Thread(target=self.client, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def client(self, conn):
+        """Perform the hub handshake with a client and forward its
+        $ConnectToMe requests to the users.\n
+        Args:
+            conn (socket): Connection to the client.
+        """
+        buf = [b""]
+        nick = None
+        self.clients.append(conn)
+        try:
+            send(conn, "$Lock EXTENDEDPROTOCOLSIMHUB Pk=pyDCsimhub|")
+            while True:
+                command = read_command(conn, buf)
+                if command is None:
+                    return
+                if command.startswith("$ValidateNick "):
+                    nick = command.split(" ", 1)[1]
+                    time.sleep(self.latency)
+                    send(conn, "$HubName pyDC simulator|"
+                               "$Hello {}|".format(nick))
+                elif command == "$GetNickList":
+                    time.sleep(self.latency)
+                    nicks = [nick, "OpChat"] + sorted(self.peers)
+                    send(conn, "$NickList {}$$|$OpList OpChat$$|".format(
+                        "$$".join(nicks)) + "".join(
+                            peer.myinfo() + "|"
+                            for peer in self.peers.values()))
+                elif command.startswith("$ConnectToMe "):
+                    _, user, address = command.split(" ")
+                    ip, port = address.rsplit(":", 1)
+                    peer = self.peers.get(user)
+                    if peer is not None:
+                        t = threading.Thread(target=peer.connect,
+                                             args=(ip, int(port)))
+                        t.daemon = True
+                        t.start()
+        except socket.error:
+            pass
+        finally:
+            self.clients.remove(conn)
+            conn.close()
+
+    def broadcast(self, message):
+        """Send a message to all connected clients.\n
+        Args:
+            message (string): The commands to send.
+        """
+        for conn in list(self.clients):
+            try:
+                send(conn, message)
+            except socket.error:
+                pass
+
+    def join(self, nick):
+        """Let a new user join the hub.\n
+        Args:
+            nick (string): Nickname of the user.
+        """
+        peer = SimPeer(nick, self.files, self.latency, self.bandwidth)
+        self.peers[nick] = peer
+        self.broadcast("$Hello {}|{}|".format(nick, peer.myinfo()))
+
+    def quit(self, nick):
+        """Let a user leave the hub.\n
+        Args:
+            nick (string): Nickname of the user.
+        """
+        if self.peers.pop(nick, None) is not None:
+            self.broadcast("$Quit {}|".format(nick))
+
+    def close(self):
+        """Stop the hub.
+        """
+        self.running = False
+        self.sock.close()
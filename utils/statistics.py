@@ -7,8 +7,8 @@ import sqlite3
 import settings
 import os
 
-from fileTypeParser import FileTypeParser as ftp
-from logs import Logger
+from utils.fileTypeParser import FileTypeParser as ftp
+from utils.logs import Logger
 
 
 class Statistics():
@@ -336,7 +336,7 @@ class Statistics():
         """
         file_object = open(filename, 'a+')
         content = file_object.read()
-        if content is "":
+        if content == "":
             self.logger.display("File {} is empty or do not exist"
                                 .format(filename), "err")
             exit(1)
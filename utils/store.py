@@ -0,0 +1,233 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'store.py' keeps each distinct file list once, named by its content.
+
+import os
+import bz2
+import uuid
+import hashlib
+import threading
+import settings
+
+EXTENSIONS = {'': ".fl", 'bz2': ".fl.bz2"}
+
+
+class ListWriter():
+
+    def __init__(self, path, compression, keep=0):
+        """Write a file list into a temporary file of the store and hash
+        the inflated xml on the way. Plain lists are written from the
+        inflated chunks, bz2 lists are stored as the bz2 stream that was
+        received (see write_stream), they are not compressed again.\n
+        Args:
+            path (string): The temporary file.
+            compression (string): 'bz2' or '' for plain xml.
+            keep (int): Keep lists up to this size in memory as well.
+        """
+        self.path = path
+        self.keep = keep
+        self.chunks = [] if keep > 0 else None
+        self.compression = compression
+        self.file = open(path, "wb")
+        self.md5 = hashlib.md5()
+        self.size = 0  # inflated bytes
+
+    def write(self, data):
+        """Add the next inflated chunk.\n
+        Args:
+            data (bytes): Part of the xml file list.
+        """
+        self.md5.update(data)
+        self.size += len(data)
+        if self.chunks is not None:
+            if self.size > self.keep:
+                self.chunks = None
+            else:
+                self.chunks.append(data)
+        if not self.compression:
+            self.file.write(data)
+
+    def write_stream(self, data):
+        """Add the next piece of the bz2 stream the inflated chunks come
+        from.\n
+        Args:
+            data (bytes): Part of the bz2 stream, without the ZL1 layer.
+        """
+        if self.compression == 'bz2':
+            self.file.write(data)
+
+    def close(self):
+        """Flush and close the temporary file.
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+
+    def digest(self):
+        """The md5 hash of the inflated file list.
+        """
+        return self.md5.hexdigest()
+
+    def data(self):
+        """The inflated file list, None if it was larger than keep.
+        """
+        if self.chunks is None:
+            return None
+        return b"".join(self.chunks)
+
+
+class ListStore():
+
+    def __init__(self, folder=None):
+        """Content addressed store of file lists. Every list is kept once
+        in folder as <md5>.fl (or .fl.bz2, see STORE_COMPRESSION), no
+        matter how many users, hubs and crawls it was fetched from. An
+        index file holds one line per list:
+        (md5sum|size|stored size|compression).\n
+        Args:
+            folder (string): Folder of the store, default STORE_FOLDER.
+        """
+        self.folder = folder or settings.STORE_FOLDER
+        self.compression = settings.STORE_COMPRESSION or ''
+        self.index_path = os.path.join(self.folder, "index")
+        self.lock = threading.Lock()
+        self.lists = {}
+        self.index_offset = 0  # bytes of the index that were read
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.refresh()
+
+    def refresh(self):
+        """Read the lines that were added to the index since it was read,
+        e.g. by other crawler processes.
+        """
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, "rb") as index_file:
+            index_file.seek(self.index_offset)
+            data = index_file.read()
+        # a line that is being written is read next time
+        data = data[:data.rfind(b"\n") + 1]
+        self.index_offset += len(data)
+        for line in data.decode('ascii', 'replace').splitlines():
+            values = line.split("|")
+            if len(values) == 4 and values[3] in EXTENSIONS:
+                try:
+                    self.lists[values[0]] = {
+                        'size': int(values[1]), 'stored': int(values[2]),
+                        'compression': values[3]}
+                except ValueError:
+                    pass
+
+    def writer(self, keep=0):
+        """Start a new file list.\n
+        Args:
+            keep (int): Keep lists up to this size in memory as well.
+        Returns:
+            A ListWriter, pass it to 'add' or 'discard' when done.
+        """
+        path = os.path.join(self.folder, str(uuid.uuid4()) + ".part")
+        return ListWriter(path, self.compression, keep)
+
+    def add(self, writer):
+        """Move a written file list into the store, unless the same list
+        is already stored.\n
+        Args:
+            writer (ListWriter): The written list.
+        Returns:
+            (string, Boolean): md5 hash of the list and True if it was
+            not stored before.
+        """
+        writer.close()
+        digest = writer.digest()
+        with self.lock:
+            if self.contains(digest):
+                os.remove(writer.path)
+                return digest, False
+            path = os.path.join(self.folder,
+                                digest + EXTENSIONS[writer.compression])
+            os.rename(writer.path, path)
+            entry = {'size': writer.size,
+                     'stored': os.path.getsize(path),
+                     'compression': writer.compression}
+            self.lists[digest] = entry
+            with open(self.index_path, "a") as index_file:
+                index_file.write("|".join([
+                    digest, str(entry['size']), str(entry['stored']),
+                    entry['compression']]) + "\n")
+        return digest, True
+
+    def discard(self, writer):
+        """Drop an incomplete file list.\n
+        Args:
+            writer (ListWriter): The written list.
+        """
+        writer.close()
+        if os.path.isfile(writer.path):
+            os.remove(writer.path)
+
+    def path(self, digest):
+        """Get the file of a stored list.\n
+        Args:
+            digest (string): md5 hash of the list.
+        Returns:
+            The path of the file, None if the list is not stored.
+        """
+        entry = self.lists.get(digest)
+        extensions = EXTENSIONS.values()
+        if entry is not None:
+            extensions = [EXTENSIONS[entry['compression']]]
+        for extension in extensions:
+            path = os.path.join(self.folder, digest + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def contains(self, digest):
+        """Check if a list is stored. Other crawler processes may have
+        stored it since the index was read, so the folder is checked as
+        well.\n
+        Args:
+            digest (string): md5 hash of the list.
+        Returns:
+            Boolean: True if the list is stored.
+        """
+        return self.path(digest) is not None
+
+    def size(self, digest):
+        """Get the inflated size of a stored list.\n
+        Args:
+            digest (string): md5 hash of the list.
+        Returns:
+            The size in bytes.
+        """
+        entry = self.lists.get(digest)
+        if entry is None:
+            # stored by another process, its size is in the index
+            with self.lock:
+                self.refresh()
+            entry = self.lists.get(digest)
+        if entry is not None:
+            return entry['size']
+        path = self.path(digest)
+        if not path.endswith(".bz2"):
+            return os.path.getsize(path)
+        # not indexed, count the inflated bytes without keeping them
+        size = 0
+        with bz2.BZ2File(path) as stored:
+            for chunk in iter(lambda: stored.read(1024 * 1024), b""):
+                size += len(chunk)
+        return size
+
+    def open(self, digest):
+        """Open a stored list for reading.\n
+        Args:
+            digest (string): md5 hash of the list.
+        Returns:
+            A file object with the inflated xml.
+        """
+        path = self.path(digest)
+        if path.endswith(".bz2"):
+            return bz2.BZ2File(path)
+        return open(path, "rb")
@@ -0,0 +1,259 @@
+#   DCbot metadata crawler for forensic lab at TU Darmstadt.
+#   2017 - Mahdi Enan and Florian Platzer
+
+#   'stream.py' handles data that arrives piece by piece from a socket.
+
+import re
+import bz2
+import time
+import zlib
+import socket
+import settings
+
+from collections import deque
+
+CID_PATTERN = re.compile(br'<FileListing[^>]*CID="([^"]*)"')
+INFLATE_SIZE = 1024 * 1024  # most bytes inflated in one step
+
+
+class ListDecompressor():
+
+    def __init__(self, output, max_size, stream=None):
+        """Inflate a file list (files.xml.bz2, optionally ZL1 compressed)
+        while it is downloaded.\n
+        Args:
+            output (file): File the inflated xml is written to.
+            max_size (int): Maximum number of inflated bytes.
+            stream (function): Called with every piece of the bz2 stream,
+            e.g. to store the list as it was received.
+        """
+        self.output = output
+        self.max_size = max_size
+        self.stream = stream
+        self.zlib = None
+        self.bz2 = bz2.BZ2Decompressor()
+        self.head = b""  # first bytes, until the stream type is known
+        self.received = 0  # bytes fed from the network
+        self.compressed = 0  # bytes of the bz2 stream
+        self.size = 0  # inflated bytes written
+        self.prolog = b""  # start of the xml, holds the CID
+        self.cid = None
+
+    def feed(self, data):
+        """Decompress the next piece of the download and write it. Both
+        layers inflate at most INFLATE_SIZE bytes per step, so max_size
+        stops a compression bomb before it fills the memory.\n
+        Args:
+            data (bytes): Data as received from the socket.
+        Raises:
+            ValueError: If the file list exceeds max_size.
+            IOError, zlib.error: If the data stream is invalid.
+        """
+        self.received += len(data)
+        if self.zlib is None and self.head is not None:
+            # ZL1 is optional, the peer may send the plain bz2 stream
+            self.head += data
+            if len(self.head) < 3:
+                return
+            data, self.head = self.head, None
+            if not data.startswith(b"BZh"):
+                self.zlib = zlib.decompressobj()
+        if self.zlib is None:
+            self.inflate(data)
+            return
+        while data and not self.done():
+            chunk = self.zlib.decompress(data, INFLATE_SIZE)
+            data = self.zlib.unconsumed_tail
+            self.inflate(chunk)
+
+    def inflate(self, data):
+        """Decompress a piece of the bz2 stream step by step and write
+        it. Data after the end of the stream is ignored.\n
+        Args:
+            data (bytes): Part of the bz2 stream.
+        Raises:
+            ValueError: If the file list exceeds max_size.
+            IOError: If the bz2 stream is invalid.
+        """
+        if not data or self.done():
+            return
+        self.compressed += len(data)
+        chunk = self.bz2.decompress(data, INFLATE_SIZE)
+        while True:
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise ValueError("file list exceeds {} bytes, "
+                                 "aborting.".format(self.max_size))
+            self.output.write(chunk)
+            if self.cid is None:
+                self.find_cid(chunk)
+            if self.bz2.eof or self.bz2.needs_input:
+                break
+            chunk = self.bz2.decompress(b"", INFLATE_SIZE)
+        if self.stream is not None:
+            # without the data after the end of the stream
+            self.stream(data[:len(data) - len(self.bz2.unused_data)])
+
+    def find_cid(self, chunk):
+        """Look for the CID attribute in the start of the file list.\n
+        Args:
+            chunk (bytes): Next inflated chunk.
+        """
+        self.prolog += chunk[:4096]
+        match = CID_PATTERN.search(self.prolog)
+        if match is not None:
+            self.cid = match.group(1).decode('utf-8', 'replace')
+        elif len(self.prolog) >= 4096:
+            self.cid = ""
+        if self.cid is not None:
+            self.prolog = b""
+
+    def done(self):
+        """True if the end of the bz2 stream was decompressed. A list
+        that is not done is incomplete.
+        """
+        return self.bz2.eof
+
+
+class Receiver():
+
+    def __init__(self, sock, min_size=None, max_size=None):
+        """Receive from a socket into a preallocated buffer. The chunk
+        size starts at min_size and grows while the socket delivers
+        full chunks, so fast connections need few recv calls.\n
+        Args:
+            sock (socket): The connection to read from.
+            min_size (int): Smallest chunk size, default RECV_MIN_SIZE.
+            max_size (int): Largest chunk size, default RECV_MAX_SIZE.
+        """
+        self.sock = sock
+        self.min_size = min_size or settings.RECV_MIN_SIZE
+        self.max_size = max_size or settings.RECV_MAX_SIZE
+        self.size = self.min_size
+        self.buffer = bytearray(self.max_size)
+        self.view = memoryview(self.buffer)
+        self.calls = 0  # recv syscalls
+        self.bytes = 0  # bytes received
+
+    def recv(self):
+        """Receive the next chunk.\n
+        Returns:
+            The received data, empty if the peer closed the connection.
+        """
+        n = self.sock.recv_into(self.view, self.size)
+        self.calls += 1
+        self.bytes += n
+        if n == self.size and self.size < self.max_size:
+            self.size = min(self.size * 2, self.max_size)
+        elif n < self.size // 4 and self.size > self.min_size:
+            self.size = max(self.size // 2, self.min_size)
+        return self.view[:n].tobytes()
+
+    def calls_per_mb(self):
+        """Number of recv calls per received megabyte.
+        """
+        if self.bytes == 0:
+            return 0.0
+        return self.calls / (self.bytes / (1024.0 * 1024.0))
+
+
+class FrameReader():
+
+    def __init__(self, sock):
+        """Split the data of a hub or user connection into protocol
+        commands. Commands are terminated by '|' and may arrive in any
+        number of pieces.\n
+        Args:
+            sock (socket): The connection to read from.
+        """
+        self.sock = sock
+        self.receiver = Receiver(sock, settings.BUFFER_SIZE)
+        self.frames = deque()  # complete commands
+        self.partial = []  # pieces of the incomplete command
+
+    def feed(self, data):
+        """Add received data and split off all complete commands.\n
+        Args:
+            data (bytes): Data as received from the socket.
+        """
+        self.partial.append(data)
+        if b"|" not in data:
+            return
+        commands = b"".join(self.partial).split(b"|")
+        self.partial = [commands.pop()]
+        self.frames.extend(commands)
+
+    def read(self, deadline=None):
+        """Return the next complete command.\n
+        Args:
+            deadline (float): Point in time (time.time()) to give up,
+            None blocks until a command arrives.
+        Returns:
+            The command without the terminating '|', as bytes.
+        Raises:
+            socket.timeout: If the deadline passed.
+            socket.error: If the connection was closed.
+        """
+        while not self.frames:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout("timed out")
+                self.sock.settimeout(remaining)
+            else:
+                self.sock.settimeout(None)
+            data = self.receiver.recv()
+            if not data:
+                raise socket.error("connection closed")
+            self.feed(data)
+        return self.frames.popleft()
+
+    def wait_for(self, prefixes, deadline=None, handler=None):
+        """Read commands until one of the expected commands arrives.\n
+        Args:
+            prefixes (tuple): Expected commands, e.g. (b"$Lock",).
+            deadline (float): Point in time (time.time()) to give up.
+            handler (function): Called with every skipped command.
+        Returns:
+            The first command that starts with one of the prefixes.
+        Raises:
+            socket.timeout: If the deadline passed.
+        """
+        while True:
+            command = self.read(deadline)
+            if command.startswith(prefixes):
+                return command
+            if handler is not None:
+                handler(command)
+
+    def poll(self):
+        """Return all commands that are available without waiting.
+        The timeout of the socket is restored, other threads may send
+        on it.
+        """
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0.0)
+        try:
+            while True:
+                data = self.receiver.recv()
+                if not data:
+                    break
+                self.feed(data)
+        except socket.error:
+            pass
+        finally:
+            self.sock.settimeout(timeout)
+        commands = list(self.frames)
+        self.frames.clear()
+        return commands
+
+    def take(self):
+        """Return the buffered data that is not a complete command yet,
+        e.g. the start of a file after $ADCSND.
+        """
+        # binary data may have been split into commands already
+        pieces = list(self.frames)
+        pieces.append(b"".join(self.partial))
+        self.frames.clear()
+        self.partial = []
+        return b"|".join(pieces)